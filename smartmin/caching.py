@@ -0,0 +1,83 @@
+"""
+Versions which SmartListView uses to invalidate cached pages. Each model has a version in our cache which is bumped
+whenever one of its instances changes, and as cache keys for pages include the version of their model, pages cached
+before a change are never read again and just expire.
+
+Only models registered as having cached lists are bumped, which list views with list_cache_timeout do when their URLs
+are loaded and whenever they cache a page. Processes which change those models without loading the URLs of their lists,
+e.g. Celery workers, should call register_cached_list for them.
+"""
+
+import threading
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+# the models which have cached lists in this process
+cached_list_models = set()
+
+
+def register_cached_list(model):
+    """
+    Registers the passed in model as having cached lists, so that changes to its instances invalidate them
+    """
+    cached_list_models.add(model)
+
+
+def list_version_key(model):
+    return "smartmin:list-version:%s" % model._meta.label_lower
+
+
+def get_list_version(model):
+    """
+    Returns the current version of the passed in model, setting one if it doesn't have one yet
+    """
+    key = list_version_key(model)
+    version = cache.get(key)
+
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+
+    return version
+
+
+# the models whose versions are waiting to be bumped when the transactions of this thread commit, by database alias
+pending_bumps = threading.local()
+
+
+def bump_pending_list_versions(using):
+    """
+    Bumps the versions of the models with changes which were waiting on the passed in database's transaction
+    """
+    models = getattr(pending_bumps, "models", {}).pop(using, None)
+    if models:
+        version = time.time_ns()
+        cache.set_many({list_version_key(model): version for model in models}, None)
+
+
+def bump_list_version(model, using=None):
+    """
+    Bumps the version of the passed in model once the current transaction on the passed in database commits, so that
+    pages aren't cached without the change by requests which can't see it yet
+    """
+    if model not in cached_list_models:
+        return
+
+    using = using or DEFAULT_DB_ALIAS
+    if not transaction.get_connection(using).in_atomic_block:
+        cache.set(list_version_key(model), time.time_ns(), None)
+        return
+
+    if not hasattr(pending_bumps, "models"):
+        pending_bumps.models = {}
+
+    pending_bumps.models.setdefault(using, set()).add(model)
+
+    # the first of these callbacks to run bumps every pending model, so a transaction which changes many instances
+    # still only bumps each model once, and any whose callbacks were rolled back with a savepoint are bumped by the
+    # next to run
+    transaction.on_commit(partial(bump_pending_list_versions, using), using=using)
@@ -0,0 +1,135 @@
+"""
+Writers of spreadsheets exported by SmartXlsView. Rows are written one at a time and sheets are split as they reach
+the most rows their format allows, with each sheet starting with the header row.
+"""
+
+import re
+
+# characters which can't be used in sheet names, and the longest a sheet name can be
+SHEET_NAME_INVALID = re.compile(r"[\[\]:*?/\\]")
+SHEET_NAME_MAX_LENGTH = 31
+
+
+class SpreadsheetWriter(object):
+    """
+    Base class for writers of spreadsheets in different formats
+    """
+
+    format = None
+    content_type = None
+
+    # the most rows a sheet can have, including its header
+    max_rows = None
+
+    def __init__(self, title, header):
+        self.title = SHEET_NAME_INVALID.sub(" ", title).strip() or "Sheet"
+        self.header = header
+        self.num_sheets = 0
+        self.num_rows = 0
+
+    def sheet_name(self, number):
+        """
+        Returns the name of the passed in sheet, which is our title followed by the sheet number after the first
+        """
+        suffix = " (%d)" % number if number > 1 else ""
+        return self.title[: SHEET_NAME_MAX_LENGTH - len(suffix)].rstrip() + suffix
+
+    def start_sheet(self):
+        self.num_sheets += 1
+        self.add_sheet(self.sheet_name(self.num_sheets))
+
+        self.num_rows = 0
+        self.append_row(self.header)
+        self.num_rows = 1
+
+    def write_row(self, values):
+        if not self.num_sheets or self.num_rows >= self.max_rows:
+            self.start_sheet()
+
+        self.append_row(values)
+        self.num_rows += 1
+
+    def save(self, file):
+        """
+        Saves our spreadsheet to the passed in file-like object
+        """
+        if not self.num_sheets:
+            self.start_sheet()
+
+        self.save_workbook(file)
+
+    def add_sheet(self, name):  # pragma: no cover
+        raise NotImplementedError()
+
+    def append_row(self, values):  # pragma: no cover
+        raise NotImplementedError()
+
+    def save_workbook(self, file):  # pragma: no cover
+        raise NotImplementedError()
+
+
+class XlsWriter(SpreadsheetWriter):
+    """
+    Writes legacy .xls workbooks with xlwt, which keeps the whole workbook in memory until it's saved, though rows are
+    serialized as they're written so they take up less of it
+    """
+
+    format = "xls"
+    content_type = "application/vnd.ms-excel"
+    max_rows = 65536
+
+    # how many rows are written before they are serialized
+    flush_rows = 1000
+
+    def __init__(self, title, header):
+        from xlwt import Workbook
+
+        super().__init__(title, header)
+        self.workbook = Workbook()
+        self.sheet = None
+
+    def add_sheet(self, name):
+        if self.sheet is not None:
+            self.sheet.flush_row_data()
+
+        self.sheet = self.workbook.add_sheet(name)
+
+    def append_row(self, values):
+        for col, value in enumerate(values):
+            self.sheet.write(self.num_rows, col, value)
+
+        if self.num_rows % self.flush_rows == 0:
+            self.sheet.flush_row_data()
+
+    def save_workbook(self, file):
+        self.workbook.save(file)
+
+
+class XlsxWriter(SpreadsheetWriter):
+    """
+    Writes .xlsx workbooks with openpyxl in write only mode, which streams rows to disk as they're written so that
+    memory use stays flat however many there are. Requires openpyxl, available with the xlsx extra.
+    """
+
+    format = "xlsx"
+    content_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    max_rows = 1048576
+
+    def __init__(self, title, header):
+        from openpyxl import Workbook
+
+        super().__init__(title, header)
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+
+    def add_sheet(self, name):
+        self.sheet = self.workbook.create_sheet(name)
+
+    def append_row(self, values):
+        self.sheet.append(values)
+
+    def save_workbook(self, file):
+        self.workbook.save(file)
+
+
+SPREADSHEET_WRITERS = {"xls": XlsWriter, "xlsx": XlsxWriter}
@@ -0,0 +1,845 @@
+"""
+Helpers used by SmartModel to import records from uploaded CSV and Excel files
+"""
+
+import codecs
+import copy
+import importlib.util
+import json
+import mmap
+import multiprocessing
+import os
+import pickle
+import re
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from operator import itemgetter
+from uuid import uuid4
+from zipfile import BadZipFile
+
+from xlrd import XLRDError, open_workbook
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+# NumPy is optional, used to convert Excel dates a column at a time if it's installed
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+# matches any of the line endings a file opened in text mode would recognize
+NEWLINE_REGEX = re.compile(rb"\r\n|\r|\n")
+
+# latin accented characters in mac_roman which are unused in cp1252, seeing them means a file is mac_roman
+MAC_ROMAN_BYTES = (b"\x81", b"\x8d", b"\x8f", b"\x90", b"\x9d")
+
+# .xlsx workbooks are zip archives, which always start with this
+ZIP_SIGNATURE = b"PK\x03\x04"
+
+# the dates which Excel date numbers count days from and the range of days xlrd converts to datetimes, for workbooks
+# using the 1900 and the 1904 date systems. The 1900 system counts a 29th of February 1900 which never happened, so
+# xlrd won't convert its first 60 days.
+XLDATE_EPOCHS = (datetime(1899, 12, 30), datetime(1904, 1, 1))
+XLDATE_DAYS = ((61, 2958466), (1, 2957004))
+
+
+def detect_ascii_codec(data, limit=None):
+    """
+    Detects the alternative codec for the passed in bytes, by default the crazy windows encoding but mac_roman if we
+    see any of its characters. Each byte is searched for with find so the scan runs at C speed and never copies data.
+    If limit is given only that many bytes from the start are scanned.
+    """
+    end = len(data) if limit is None else min(limit, len(data))
+
+    for byte in MAC_ROMAN_BYTES:
+        if data.find(byte, 0, end) >= 0:
+            return "mac_roman"
+
+    return "cp1252"
+
+
+def convert_xldates(xldates, datemode, tz):
+    """
+    Converts a list of Excel date numbers to datetimes in the passed in timezone, all at once with NumPy if it's
+    installed. Conversion matches xlrd's xldate_as_tuple, including rounding to the nearest second. Numbers which xlrd
+    wouldn't convert to a datetime, like times without a date, are returned as None to be converted a cell at a time.
+    """
+    min_days, max_days = XLDATE_DAYS[datemode]
+    epoch = XLDATE_EPOCHS[datemode]
+
+    if numpy is not None:
+        values = numpy.asarray(xldates, dtype=float)
+        days = numpy.trunc(values)
+        seconds = numpy.round((values - days) * 86400.0)
+
+        # a time which rounds up to midnight moves on to the next day
+        valid_days = days + (seconds == 86400)
+        valid = (valid_days >= min_days) & (valid_days < max_days)
+
+        days = numpy.where(valid, days, 0).astype("timedelta64[D]")
+        seconds = numpy.where(valid, seconds, 0).astype("timedelta64[s]")
+        dates = (numpy.datetime64(epoch, "s") + days + seconds).tolist()
+
+        return [date.replace(tzinfo=tz) if is_valid else None for date, is_valid in zip(dates, valid.tolist())]
+
+    epoch = epoch.replace(tzinfo=tz)
+    dates = []
+    for xldate in xldates:
+        days = int(xldate)
+        seconds = round((xldate - days) * 86400.0)
+
+        if min_days <= days + (seconds == 86400) < max_days:
+            dates.append(epoch + timedelta(days=days, seconds=seconds))
+        else:
+            dates.append(None)
+
+    return dates
+
+
+def chunk_list(iterable, size):
+    """
+    Splits the passed in iterable into lists of at most size items, consuming it lazily
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ImportColumnPlan(object):
+    """
+    A plan for turning the values of each row of an import into field values. The plan is compiled once per chunk of
+    rows into a function which does no per-row lookups. Models can return a plan from validate_import_header to convert
+    the values of columns, drop columns they don't use or add constant fields. Plans are sent to the worker processes of
+    models with import_workers, so their converters should be module level functions rather than lambdas.
+    """
+
+    def __init__(self, header, converters=None, dropped=(), constants=None):
+        self.header = list(header)
+        self.converters = converters or {}
+        self.dropped = set(dropped)
+        self.constants = constants or {}
+
+        # applied to the value of every column before any converter, set by readers whose values need normalizing
+        self.normalize = None
+
+    def copy(self, normalize=None):
+        """
+        Returns a copy of this plan, with the passed in normalize function if given
+        """
+        plan = copy.copy(self)
+        plan.header = list(self.header)
+        plan.converters = dict(self.converters)
+        plan.dropped = set(self.dropped)
+        plan.constants = dict(self.constants)
+        if normalize is not None:
+            plan.normalize = normalize
+        return plan
+
+    def is_picklable(self):
+        """
+        Returns whether this plan can be sent to worker processes, which it can't if its converters or normalize
+        function are lambdas or functions defined inside other functions rather than module level functions
+        """
+        try:
+            pickle.dumps(self)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return False
+        return True
+
+    def compile(self, constants=None):
+        """
+        Compiles this plan into a function which takes the values of a row and returns its field values. The passed in
+        constants are added to every row, though constants of the plan itself take precedence.
+        """
+        constants = dict(constants or {}, **self.constants)
+        normalize = self.normalize
+
+        columns = [index for index, name in enumerate(self.header) if name not in self.dropped]
+        names = [self.header[index] for index in columns]
+        conversions = [(name, self.converters[name]) for name in names if name in self.converters]
+
+        # we only need to pick out columns if some are being dropped
+        if len(columns) == len(self.header):
+            pick = None
+        elif len(columns) == 1:
+            index = columns[0]
+
+            def pick(values):
+                return (values[index],)
+
+        else:
+            pick = itemgetter(*columns) if columns else (lambda values: ())
+
+        def build(values):
+            if pick:
+                values = pick(values)
+            if normalize:
+                values = [normalize(value) for value in values]
+
+            field_values = dict(zip(names, values))
+            for name, convert in conversions:
+                field_values[name] = convert(field_values[name])
+
+            field_values.update(constants)
+            return field_values
+
+        return build
+
+
+class ImportLookup(object):
+    """
+    Resolves the values of a column to related objects by a natural key field, e.g. category names to categories.
+    Lookups last for a whole import, the keys of each chunk of rows are fetched together in a single query, and keys
+    which don't match anything are remembered so they are never looked up again. Keys are converted to the type of
+    the field, so e.g. the text of a cell matches an integer field.
+    """
+
+    def __init__(self, queryset, field):
+        self.queryset = queryset
+        self.field = field
+        self.cache = {}
+
+        self.model_field = queryset.model._meta.get_field(field)
+
+    def to_key(self, value):
+        """
+        Converts the passed in value to the type of our field, returning None if it isn't a valid value for it
+        """
+        try:
+            return self.model_field.to_python(value)
+        except ValidationError:
+            return None
+
+    def prefetch(self, keys):
+        """
+        Fetches the objects for any of the passed in keys we haven't already looked up
+        """
+        missing = {self.to_key(key) for key in keys} - set(self.cache) - {None}
+        if not missing:
+            return
+
+        for obj in self.queryset.filter(**{"%s__in" % self.field: missing}):
+            self.cache[self.to_key(getattr(obj, self.field))] = obj
+
+        for key in missing:
+            self.cache.setdefault(key, None)
+
+    def get(self, key):
+        """
+        Returns the object for the passed in key, or None if there isn't one
+        """
+        value = self.to_key(key)
+        if value is None:
+            return None
+
+        if value not in self.cache:
+            self.prefetch((key,))
+
+        return self.cache[value]
+
+    def add(self, key, obj):
+        """
+        Adds an object to our cache, e.g. one created while preparing an earlier row
+        """
+        self.cache[self.to_key(key)] = obj
+
+
+def prefetch_lookups(lookups, plan, rows):
+    """
+    Prefetches the keys used by a chunk of rows for each of the passed in lookups, which are keyed by column name
+    """
+    for column, lookup in lookups.items():
+        if column not in plan.header:
+            continue
+
+        index = plan.header.index(column)
+        keys = {values[index] for line_number, values in rows if index < len(values)}
+        if plan.normalize:
+            keys = {plan.normalize(key) for key in keys}
+
+        lookup.prefetch(keys)
+
+
+# the state of an import worker process, set up once when the worker starts
+worker_state = {}
+
+
+def init_import_worker(model_label, pickled_args, import_params):
+    """
+    Sets up an import worker process. Workers are spawned rather than forked so they never share our database
+    connections, which means Django has to be set up before our column plan and user can be unpickled. As a result
+    workers only see data which the importing process has committed, and use the settings module as it is on disk.
+    """
+    import django
+    from django.apps import apps
+
+    django.setup()
+
+    model = apps.get_model(model_label)
+
+    worker_state["model"] = model
+    worker_state["plan"], worker_state["user"] = pickle.loads(pickled_args)
+
+    # each worker has its own lookups, which fetch related objects over its own connection
+    worker_state["import_params"] = model.with_import_lookups(import_params)
+
+
+def prepare_import_chunk(chunk):
+    """
+    Prepares a chunk of rows in an import worker process
+    """
+    model = worker_state["model"]
+    return list(
+        model.prepare_import_rows(worker_state["plan"], chunk, worker_state["user"], worker_state["import_params"])
+    )
+
+
+def prepare_import_chunks_parallel(model, plan, rows, user, import_params, workers, chunk_size):
+    """
+    Prepares rows a chunk at a time across a pool of worker processes, yielding the prepared chunks in file order. Only
+    a couple of chunks per worker are in flight at any time so rows are still read lazily.
+    """
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_import_worker,
+        initargs=(model._meta.label, pickle.dumps((plan, user)), import_params),
+    )
+    pending = deque()
+
+    try:
+        for chunk in chunk_list(rows, chunk_size):
+            pending.append(executor.submit(prepare_import_chunk, chunk))
+
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+class ImportedRecords(object):
+    """
+    Collection of the records created by a streaming import. Only the primary keys of the records are kept in
+    memory, the records themselves are loaded a chunk at a time when iterated.
+    """
+
+    def __init__(self, model, chunk_size=1000):
+        self.model = model
+        self.chunk_size = chunk_size
+
+        # integer keys are packed into an array, anything else falls back to a plain list
+        self.pks = array("q")
+
+    def append(self, record):
+        self.append_pk(record.pk)
+
+    def append_pk(self, pk):
+        if isinstance(self.pks, array):
+            try:
+                self.pks.append(pk)
+                return
+            except (TypeError, OverflowError):
+                self.pks = list(self.pks)
+
+        self.pks.append(pk)
+
+    def chunked_pks(self):
+        """
+        Yields our primary keys in lists of at most chunk_size keys
+        """
+        for start in range(0, len(self.pks), self.chunk_size):
+            yield list(self.pks[start : start + self.chunk_size])
+
+    def __iter__(self):
+        for pks in self.chunked_pks():
+            records = self.model._base_manager.in_bulk(pks)
+            for pk in pks:
+                if pk in records:
+                    yield records[pk]
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __bool__(self):
+        return len(self.pks) > 0
+
+
+class TextLines(object):
+    """
+    Iterator over the decoded lines of a memory-mapped file, translating line endings the same way a file opened in
+    text mode would. Keeps track of the byte offset where the next line starts so that reading can later be resumed
+    from there.
+    """
+
+    def __init__(self, view, encoding, position=0):
+        self.view = view
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.position = position
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        view = self.view
+        if self.position >= len(view):
+            raise StopIteration
+
+        # searches are made one line at a time so that no reference to our view is held between lines
+        match = NEWLINE_REGEX.search(view, self.position)
+        if not match:
+            line = self.decoder.decode(view[self.position :], final=True)
+            self.position = len(view)
+            return line
+
+        line = self.decoder.decode(view[self.position : match.start()]) + "\n"
+        self.position = match.end()
+        return line
+
+
+class ImportCheckpoint(object):
+    """
+    Records how far an import has got. Each committed chunk of rows moves the checkpoint forward to its last line, and
+    an import given a checkpoint skips straight past the rows it covers.
+    """
+
+    def __init__(
+        self, line=0, offset=None, records=0, errors=0, error_messages=None, pks=None, finished=False, on_commit=None
+    ):
+        # the last committed line and, for CSV files, the byte offset where the line after it starts
+        self.line = line
+        self.offset = offset
+
+        # the results of the rows committed so far
+        self.records = records
+        self.errors = errors
+        self.error_messages = error_messages or []
+
+        # the primary keys of the records committed so far, with runs of consecutive integer keys packed into
+        # [first, last] pairs and any other keys as strings
+        self.pks = pks or []
+
+        # whether the import has got to the end of its file
+        self.finished = finished
+
+        self.on_commit = on_commit
+
+        # byte offsets of rows which have been read but not yet committed
+        self.offsets = {}
+
+    @classmethod
+    def from_results(cls, import_results, on_commit=None):
+        """
+        Creates a checkpoint from the JSON import results of a previous run of an import, if it recorded one
+        """
+        results = json.loads(import_results) if import_results else {}
+        if "checkpoint" not in results:
+            return cls(on_commit=on_commit)
+
+        return cls(
+            line=results["checkpoint"]["line"],
+            offset=results["checkpoint"]["offset"],
+            records=results["records"],
+            errors=results["errors"],
+            error_messages=results["error_messages"],
+            pks=results["checkpoint"].get("pks"),
+            finished=results["checkpoint"].get("finished", False),
+            on_commit=on_commit,
+        )
+
+    def as_json(self):
+        return dict(line=self.line, offset=self.offset, pks=self.pks, finished=self.finished)
+
+    def get_records(self, model, chunk_size=1000):
+        """
+        Returns the records committed so far as ImportedRecords
+        """
+        records = ImportedRecords(model, chunk_size)
+
+        for packed in self.pks:
+            if isinstance(packed, list):
+                for pk in range(packed[0], packed[1] + 1):
+                    records.append_pk(pk)
+            else:
+                records.append_pk(model._meta.pk.to_python(packed))
+
+        return records
+
+    def add_pks(self, pks):
+        """
+        Adds the primary keys of newly committed records
+        """
+        for pk in pks:
+            if isinstance(pk, int):
+                if self.pks and isinstance(self.pks[-1], list) and self.pks[-1][1] == pk - 1:
+                    self.pks[-1][1] = pk
+                else:
+                    self.pks.append([pk, pk])
+            else:
+                self.pks.append(str(pk))
+
+    def mark(self, line, offset):
+        """
+        Notes the byte offset where the row after the passed in line starts
+        """
+        self.offsets[line] = offset
+
+    def commit(self, line, import_results, pks=()):
+        """
+        Moves our checkpoint to the passed in line, along with the primary keys of the records created since it was
+        last committed, adding it to the passed in partial results
+        """
+        self.add_pks(pks)
+        self.line = line
+        self.offset = self.offsets.get(line, self.offset)
+        self.offsets = {marked: offset for marked, offset in self.offsets.items() if marked > line}
+
+        import_results["checkpoint"] = self.as_json()
+
+        if self.on_commit:
+            self.on_commit(import_results)
+
+
+class ImportProgress(object):
+    """
+    Reports how an import is getting on to a callback every so many rows. Reports are only made between chunks of
+    rows, so the cost to an import is one comparison per chunk and reports may come a little later than asked for.
+    """
+
+    def __init__(self, callback, interval=1000):
+        self.callback = callback
+        self.interval = interval
+        self.started_on = time.monotonic()
+
+        # the rows read by this run of the import, and the results of the import so far including any previous runs
+        self.rows = 0
+        self.errors = 0
+        self.results = {}
+
+        self._next_report = interval
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started_on
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed else 0.0
+
+    def update(self, rows, results):
+        """
+        Notes the rows read so far, calling our callback if enough have been read since it was last called. Results is
+        a function returning the partial results of the import, only called when a report is made.
+        """
+        self.rows = rows
+
+        if rows >= self._next_report:
+            # skip over any reports which a large chunk has taken us past
+            self._next_report = (rows // self.interval + 1) * self.interval
+
+            import_results = results()
+            self.errors = import_results["errors"]
+            self.results = dict(import_results, progress=self.as_json())
+            self.callback(self)
+
+    def as_json(self):
+        return dict(
+            rows=self.rows,
+            errors=self.errors,
+            elapsed=round(self.elapsed, 3),
+            rows_per_second=round(self.rows_per_second, 1),
+        )
+
+
+class ImportSource(object):
+    """
+    A file being imported. The file is kept on local disk and memory-mapped so that sniffing its format and
+    encoding and parsing it all share the same view of it, without the file ever being read into memory. Once parsed
+    by SmartModel.parse_import_source, a source also remembers its format and header so that it can be passed to
+    get_import_file_headers and then import_csv without being parsed again.
+    """
+
+    def __init__(self, path, temporary=False):
+        self.path = path
+        self.temporary = temporary
+
+        # set when we're parsed, the format is csv or that of the spreadsheet reader which accepted us
+        self.format = None
+        self.header = None
+        self.header_line = None
+
+        # for CSV files, the byte offset where the rows after our header start
+        self.data_offset = None
+
+        # for spreadsheets, the reader our header was read with, kept open until it's used to read our rows
+        self.reader = None
+
+        self._file = None
+        self._view = None
+        self._ascii_codec = None
+
+    @classmethod
+    def from_upload(cls, csv_file):
+        """
+        Creates a source for an uploaded file, using it where it is if our storage keeps it on local disk and
+        otherwise streaming it to a temporary file a chunk at a time.
+        """
+        try:
+            path = csv_file.path
+        except (AttributeError, NotImplementedError, ValueError):
+            path = None
+
+        if not path and hasattr(csv_file, "temporary_file_path"):
+            path = csv_file.temporary_file_path()
+
+        if path and os.path.isfile(path):
+            return cls(path)
+
+        tmp_dir = os.path.join(settings.MEDIA_ROOT, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_file = os.path.join(tmp_dir, str(uuid4()))
+
+        csv_file.open("rb")
+        with open(tmp_file, "wb") as out_file:
+            for chunk in csv_file.chunks():
+                out_file.write(chunk)
+
+        return cls(tmp_file, temporary=True)
+
+    @classmethod
+    def for_file(cls, filename):
+        """
+        Returns a source for the passed in source or file object
+        """
+        return filename if isinstance(filename, ImportSource) else cls(filename.name)
+
+    @property
+    def name(self):
+        # lets us be used anywhere a file object was previously passed in
+        return self.path
+
+    @property
+    def view(self):
+        """
+        A read-only memory map of our file, or an empty bytes object if our file is empty
+        """
+        # readers like xlrd close the map they're given when they're done with it, in which case we map it again
+        if isinstance(self._view, mmap.mmap) and self._view.closed:
+            self.release()
+
+        if self._view is None:
+            self._file = open(self.path, "rb")
+            if os.fstat(self._file.fileno()).st_size:
+                self._view = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._view = b""
+
+        return self._view
+
+    @property
+    def ascii_codec(self):
+        """
+        The alternative codec for our file, only detected once however many times it's asked for. The number of bytes
+        scanned can be limited with the SMARTMIN_IMPORT_SNIFF_BYTES setting.
+        """
+        if self._ascii_codec is None:
+            self._ascii_codec = detect_ascii_codec(self.view, getattr(settings, "SMARTMIN_IMPORT_SNIFF_BYTES", None))
+
+        return self._ascii_codec
+
+    def text_lines(self, encoding="utf-8-sig", offset=0):
+        """
+        Returns an iterator over the decoded lines of our file starting at the passed in byte offset
+        """
+        return TextLines(self.view, encoding, offset)
+
+    @property
+    def parsed(self):
+        return self.header is not None
+
+    def release(self):
+        """
+        Releases our memory map and any open reader, the map will be recreated if it is used again
+        """
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+
+        if isinstance(self._view, mmap.mmap) and not self._view.closed:
+            self._view.close()
+        if self._file:
+            self._file.close()
+
+        self._view = None
+        self._file = None
+
+    def close(self):
+        """
+        Releases our memory map and removes our file if it was a temporary copy of an upload
+        """
+        self.release()
+
+        if self.temporary and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class UnreadableSpreadsheet(Exception):
+    """
+    Raised by spreadsheet readers when a file they accepted turns out not to be a spreadsheet they can read
+    """
+
+
+class SpreadsheetReader(object):
+    """
+    Reads the first sheet of a spreadsheet being imported. Each subclass reads a different spreadsheet format, models
+    pick which formats they accept, and in which order they are tried, with their import_readers attribute.
+    """
+
+    format = None
+
+    def __init__(self, model, source):
+        self.model = model
+        self.source = source
+
+    @classmethod
+    def accepts(cls, source):
+        """
+        Whether this reader should be tried for the passed in source
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def header(self):
+        """
+        Returns the raw values of the header row of our sheet
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def rows(self, tz, first_row=1):
+        """
+        Yields the line number and cell values of each row of our sheet from the passed in row index onwards, with
+        date cells in the passed in timezone
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def close(self):
+        pass
+
+
+class XlsReader(SpreadsheetReader):
+    """
+    Reads legacy .xls workbooks with xlrd. Any file is accepted, xlrd raising XLRDError for anything which turns out not
+    to be a workbook it can read.
+    """
+
+    format = "xls"
+
+    def __init__(self, model, source):
+        super().__init__(model, source)
+
+        if not source.view:
+            raise XLRDError("File size is 0 bytes")
+
+        try:
+            self.workbook = open_workbook(file_contents=source.view)
+        except BadZipFile as e:
+            # xlrd looks inside anything which starts like a zip archive to see if it's an .xlsx workbook
+            raise UnreadableSpreadsheet(str(e))
+
+        self.sheet = self.workbook.sheet_by_index(0)
+
+    @classmethod
+    def accepts(cls, source):
+        return True
+
+    def header(self):
+        return [str(self.sheet.cell(0, col).value) for col in range(self.sheet.ncols)]
+
+    def rows(self, tz, first_row=1):
+        sheet = self.sheet
+        chunk_size = self.model.import_chunk_size
+
+        # cells are read and converted a column at a time for each chunk of rows, then zipped back into rows
+        for start in range(first_row, sheet.nrows, chunk_size):
+            end = min(start + chunk_size, sheet.nrows)
+            columns = [
+                self.model.get_column_values(
+                    self.workbook, tz, sheet.col_values(col, start, end), sheet.col_types(col, start, end)
+                )
+                for col in range(sheet.ncols)
+            ]
+
+            # line numbers include our header row
+            for row, values in enumerate(zip(*columns), start + 1):
+                yield row, list(values)
+
+
+class XlsxReader(SpreadsheetReader):
+    """
+    Reads .xlsx workbooks with openpyxl in read only mode, which parses rows as they are read rather than loading the
+    whole workbook into memory. openpyxl is an optional dependency, without it .xlsx files aren't accepted.
+    """
+
+    format = "xlsx"
+
+    def __init__(self, model, source):
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+
+        super().__init__(model, source)
+
+        # openpyxl checks the extension of paths, and copies of uploads don't have one, so it's given the file itself
+        self.file = open(source.path, "rb")
+        try:
+            self.workbook = load_workbook(self.file, read_only=True, data_only=True)
+            self.sheet = self.workbook.worksheets[0]
+
+            header = next(self.sheet.iter_rows(max_row=1, values_only=True), ())
+        except (InvalidFileException, KeyError, IndexError, BadZipFile) as e:
+            # zip archives which aren't workbooks, e.g. .docx files, can be left for other readers to try
+            self.file.close()
+            raise UnreadableSpreadsheet(str(e))
+        except Exception:
+            self.file.close()
+            raise
+
+        self.columns = ["" if value is None else str(value) for value in header]
+
+    @classmethod
+    def accepts(cls, source):
+        return source.view[:4] == ZIP_SIGNATURE and importlib.util.find_spec("openpyxl") is not None
+
+    def header(self):
+        return self.columns
+
+    def rows(self, tz, first_row=1):
+        width = len(self.columns)
+        get_value = self.model.get_xlsx_cell_value
+
+        for row, values in enumerate(self.sheet.iter_rows(min_row=first_row + 1, values_only=True), first_row):
+            # rows in read only mode can be short if the workbook doesn't record its dimensions
+            values = [get_value(tz, value) for value in values[:width]]
+            if len(values) < width:
+                values += [""] * (width - len(values))
+
+            yield row + 1, values
+
+    def close(self):
+        self.workbook.close()
+        self.file.close()
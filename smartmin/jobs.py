@@ -0,0 +1,410 @@
+"""
+Runs SmartModel imports and exports of SmartCsvView and SmartXlsView as background jobs. Jobs are run by the import
+runner named by the SMARTMIN_IMPORT_RUNNER setting, either "local" which runs them on a pool of threads in this process
+or "celery" which runs them as Celery tasks. Imports and exports share the runner and, for the local runner, its
+SMARTMIN_IMPORT_THREADS threads, which run in the web process so deployments should use Celery. Either way, no more
+than import_concurrency imports of a model are run at once.
+"""
+
+import json
+import logging
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class ImportJob(object):
+    """
+    An import of the file of a task into a model. Tasks are anything with csv_file, created_by, import_params and
+    import_results attributes, but must be saved model instances for jobs run by Celery.
+    """
+
+    celery_task = "run_import_job"
+
+    def __init__(self, model, task, queued_on=None):
+        self.model = model
+        self.task = task
+        self.queued_on = queued_on or timezone.now()
+
+    @property
+    def queue(self):
+        return self.model._meta.label
+
+    @property
+    def concurrency(self):
+        return self.model.import_concurrency
+
+    @classmethod
+    def from_json(cls, job_json):
+        task_model = apps.get_model(job_json["task_model"])
+
+        return cls(
+            apps.get_model(job_json["model"]),
+            task_model._default_manager.get(pk=job_json["task_id"]),
+            queued_on=parse_datetime(job_json["queued_on"]),
+        )
+
+    def as_json(self):
+        return dict(
+            model=self.model._meta.label,
+            task_model=self.task._meta.label,
+            task_id=self.task.pk,
+            queued_on=self.queued_on.isoformat(),
+        )
+
+    def run(self):
+        """
+        Runs our import and then finalizes it, recording how long it waited, how long it took and how many rows per
+        second it got through in the results of our task
+        """
+        started_on = timezone.now()
+        start = time.perf_counter()
+
+        try:
+            # each chunk of rows is committed as it goes, rather than the whole import being held in one transaction
+            # where no one else could see its progress, and a retried import returns the records of earlier runs too
+            # so that finalize_import always gets every record
+            records = self.model.import_csv(self.task, checkpoints=True)
+        except Exception as e:
+            self.record_timing(started_on, time.perf_counter() - start, error=str(e))
+            raise
+
+        self.record_timing(started_on, time.perf_counter() - start)
+        self.model.finalize_import(self.task, records)
+        return records
+
+    def execute(self):
+        """
+        Runs this job for a runner, returning the number of records imported
+        """
+        return len(self.run())
+
+    def record_timing(self, started_on, elapsed, error=None):
+        results = json.loads(self.task.import_results) if self.task.import_results else {}
+        rows = results.get("records", 0) + results.get("errors", 0)
+
+        results["timing"] = dict(
+            queued_on=self.queued_on.isoformat(),
+            started_on=started_on.isoformat(),
+            waited=round((started_on - self.queued_on).total_seconds(), 3),
+            elapsed=round(elapsed, 3),
+            rows_per_second=round(rows / elapsed, 1) if elapsed else 0.0,
+        )
+        if error is not None:
+            results["error"] = error
+
+        self.model.save_import_results(self.task, results)
+
+        logger.info(
+            "Import into %s %s in %.3fs, %d rows at %.1f rows/sec",
+            self.model._meta.label,
+            "failed" if error is not None else "finished",
+            elapsed,
+            rows,
+            results["timing"]["rows_per_second"],
+        )
+
+
+class ExportJob(object):
+    """
+    An export of a SmartCsvView or SmartXlsView to a file in our default storage. The view is recreated from the path
+    (without any script prefix) and query string of the request which queued the export and run as the user who made
+    it, going through the same permission check and pre_process as that request, so it exports the same objects and
+    fields it would have then. The state of each export is kept in our cache for
+    SMARTMIN_EXPORT_TIMEOUT seconds, so must be shared by web and worker processes.
+    """
+
+    celery_task = "run_export_job"
+    concurrency = None
+
+    def __init__(self, export_id, path_info, query_string, user_id, queued_on=None):
+        self.export_id = export_id
+        self.path_info = path_info
+        self.query_string = query_string
+        self.user_id = user_id
+        self.queued_on = queued_on or timezone.now()
+
+    @classmethod
+    def create(cls, request):
+        """
+        Creates a new export of the view of the passed in request, recording it as queued
+        """
+        job = cls(uuid.uuid4().hex, request.path_info, request.GET.urlencode(), request.user.pk)
+        set_export_state(job.export_id, dict(status="queued", user_id=job.user_id))
+        return job
+
+    @classmethod
+    def from_json(cls, job_json):
+        return cls(
+            job_json["export_id"],
+            job_json["path_info"],
+            job_json["query_string"],
+            job_json["user_id"],
+            queued_on=parse_datetime(job_json["queued_on"]),
+        )
+
+    def as_json(self):
+        return dict(
+            export_id=self.export_id,
+            path_info=self.path_info,
+            query_string=self.query_string,
+            user_id=self.user_id,
+            queued_on=self.queued_on.isoformat(),
+        )
+
+    @property
+    def queue(self):
+        return "export:%s" % self.path_info
+
+    def create_view(self):
+        """
+        Recreates the view being exported, along with the request it was queued by, and prepares it as that request
+        was prepared
+        """
+        match = resolve(self.path_info)
+
+        request = HttpRequest()
+        request.method = "GET"
+        request.path = request.path_info = self.path_info
+        request.GET = QueryDict(self.query_string)
+        request.user = (
+            get_user_model()._default_manager.get(pk=self.user_id) if self.user_id is not None else AnonymousUser()
+        )
+
+        view = match.func.view_class(**match.func.view_initkwargs)
+        view.setup(request, *match.args, **match.kwargs)
+
+        # users may have lost the permission they had when they queued the export
+        if not view.has_permission(request, *match.args, **match.kwargs):
+            raise PermissionDenied("%s no longer has permission to export %s" % (request.user, self.path_info))
+
+        if view.pre_process(request, *match.args, **match.kwargs):
+            raise ImproperlyConfigured(
+                "%s can't be exported in the background as its pre_process returned a response"
+                % view.__class__.__name__
+            )
+
+        return view
+
+    def run(self):
+        """
+        Writes our export to a temporary file and then saves that to our default storage, returning its name there
+        """
+        set_export_state(self.export_id, dict(status="running", user_id=self.user_id))
+
+        try:
+            view = self.create_view()
+            view.object_list = view.get_queryset()
+            filename = view.derive_filename()
+
+            with tempfile.TemporaryFile() as output:
+                view.write_export(output)
+                output.seek(0)
+                name = default_storage.save("exports/%s/%s" % (self.export_id, filename), File(output))
+        except Exception as e:
+            set_export_state(self.export_id, dict(status="failed", user_id=self.user_id, error=str(e)))
+            raise
+
+        set_export_state(self.export_id, dict(status="complete", user_id=self.user_id, file=name, filename=filename))
+        return name
+
+    def execute(self):
+        """
+        Runs this job for a runner, returning the name of the exported file in our storage
+        """
+        return self.run()
+
+
+def export_state_key(export_id):
+    return "smartmin:export:%s" % export_id
+
+
+def get_export_state(export_id):
+    """
+    Returns the state of the passed in export, or None if there is no such export or it has expired
+    """
+    return cache.get(export_state_key(export_id))
+
+
+def get_export_timeout():
+    return getattr(settings, "SMARTMIN_EXPORT_TIMEOUT", 24 * 60 * 60)
+
+
+def set_export_state(export_id, state):
+    cache.set(export_state_key(export_id), state, get_export_timeout())
+
+
+def delete_expired_exports():
+    """
+    Deletes the files of exports which are older than SMARTMIN_EXPORT_TIMEOUT, and so can no longer be downloaded,
+    returning how many were deleted
+    """
+    if not default_storage.exists("exports"):
+        return 0
+
+    expired_on = timezone.now() - timedelta(seconds=get_export_timeout())
+    deleted = 0
+
+    export_ids, _ = default_storage.listdir("exports")
+    for export_id in export_ids:
+        directory = "exports/%s" % export_id
+        for filename in default_storage.listdir(directory)[1]:
+            name = "%s/%s" % (directory, filename)
+            if default_storage.get_modified_time(name) < expired_on:
+                default_storage.delete(name)
+                deleted += 1
+
+    return deleted
+
+
+class ImportRunner(object):
+    """
+    Base class for the runners of import and export jobs
+    """
+
+    def submit(self, job):
+        """
+        Queues the passed in job, returning a handle whose result will be what it returns when executed, i.e. the
+        number of records imported or the name of the exported file
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+
+class LocalImportRunner(ImportRunner):
+    """
+    Runs import and export jobs on a pool of threads in this process, which needs no broker so suits development and
+    tests, but in a web process takes threads from serving requests and loses any jobs running when it restarts. Jobs
+    for a model already running as many imports as it allows wait in a queue of their own rather than taking up a
+    thread. The size of the pool is set with SMARTMIN_IMPORT_THREADS, and setting it to 0 runs each job as it's
+    submitted.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = getattr(settings, "SMARTMIN_IMPORT_THREADS", 4) if max_workers is None else max_workers
+        self.executor = ThreadPoolExecutor(self.max_workers, "smartmin-import") if self.max_workers else None
+
+        self.lock = threading.Lock()
+        self.queued = defaultdict(deque)
+        self.running = defaultdict(int)
+
+    def submit(self, job):
+        future = Future()
+
+        if not self.executor:
+            self.run(job, future)
+            return future
+
+        with self.lock:
+            self.queued[job.queue].append((job, future))
+
+        self.dispatch(job)
+        return future
+
+    def dispatch(self, job):
+        """
+        Starts as many queued jobs from the queue of the passed in job as its concurrency limit allows
+        """
+        queue = job.queue
+        limit = job.concurrency
+
+        with self.lock:
+            while self.queued[queue] and (not limit or self.running[queue] < limit):
+                queued_job, future = self.queued[queue].popleft()
+                self.running[queue] += 1
+                self.executor.submit(self.run_threaded, queued_job, future)
+
+    def run(self, job, future):
+        if not future.set_running_or_notify_cancel():
+            return
+
+        try:
+            future.set_result(job.execute())
+        except Exception as e:
+            future.set_exception(e)
+
+    def run_threaded(self, job, future):
+        try:
+            self.run(job, future)
+        finally:
+            # each thread has its own database connections which are closed once its job is done
+            connections.close_all()
+
+            with self.lock:
+                self.running[job.queue] -= 1
+
+            self.dispatch(job)
+
+
+class CeleryImportRunner(ImportRunner):
+    """
+    Runs jobs as Celery tasks. Concurrency limits are shared between workers through our cache, with jobs for a model
+    at its limit retried after SMARTMIN_IMPORT_RETRY_DELAY seconds. Celery's eager mode runs jobs without a broker, in
+    which case they run as they are submitted and aren't limited.
+    """
+
+    def submit(self, job):
+        from . import tasks
+
+        return getattr(tasks, job.celery_task).delay(job.as_json())
+
+
+def acquire_import_slot(model):
+    """
+    Takes one of the slots the passed in model has for running imports, returning its cache key, or None if they
+    are all taken. Slots expire after SMARTMIN_IMPORT_SLOT_TIMEOUT seconds in case a worker dies holding one.
+    """
+    limit = model.import_concurrency or 0
+    if not limit:
+        return ""
+
+    timeout = getattr(settings, "SMARTMIN_IMPORT_SLOT_TIMEOUT", 6 * 60 * 60)
+    for slot in range(limit):
+        key = "smartmin:import-slot:%s:%d" % (model._meta.label_lower, slot)
+        if cache.add(key, True, timeout):
+            return key
+
+    return None
+
+
+def release_import_slot(key):
+    if key:
+        cache.delete(key)
+
+
+# runners are created once per process, the first time they are used
+IMPORT_RUNNERS = {"local": "smartmin.jobs.LocalImportRunner", "celery": "smartmin.jobs.CeleryImportRunner"}
+import_runners = {}
+
+
+def get_import_runner():
+    """
+    Returns the import runner named by our SMARTMIN_IMPORT_RUNNER setting, either a key of IMPORT_RUNNERS or the
+    dotted path of a runner class
+    """
+    name = getattr(settings, "SMARTMIN_IMPORT_RUNNER", "local")
+
+    if name not in import_runners:
+        import_runners[name] = import_string(IMPORT_RUNNERS.get(name, name))()
+
+    return import_runners[name]
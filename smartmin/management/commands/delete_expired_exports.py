@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from smartmin.jobs import delete_expired_exports
+
+
+class Command(BaseCommand):
+    help = "Deletes the files of background exports which have expired"
+
+    def handle(self, *args, **options):
+        deleted = delete_expired_exports()
+        self.stdout.write("Deleted %d expired export files" % deleted)
@@ -1,15 +1,37 @@
 import csv
 import json
+import logging
 import traceback
 import zoneinfo
-from datetime import datetime, timezone as tzone
+from contextlib import nullcontext
+from datetime import date, datetime, timezone as tzone
 
-from xlrd import XL_CELL_DATE, XLRDError, open_workbook, xldate_as_tuple
+from xlrd import XL_CELL_DATE, XLRDError, xldate_as_tuple
+from xlrd.sheet import Cell
 
 from django.conf import settings
-from django.db import models
+from django.db import DatabaseError, models, router, transaction
 from django.utils import timezone
 
+from .caching import bump_list_version
+from .imports import (
+    ImportCheckpoint,
+    ImportColumnPlan,
+    ImportedRecords,
+    ImportProgress,
+    ImportSource,
+    UnreadableSpreadsheet,
+    XlsReader,
+    XlsxReader,
+    chunk_list,
+    convert_xldates,
+    prefetch_lookups,
+    prepare_import_chunks_parallel,
+)
+from .jobs import ImportJob, get_import_runner
+
+logger = logging.getLogger(__name__)
+
 
 class SmartImportRowError(Exception):
     def __init__(self, message):
@@ -54,11 +76,49 @@ class SmartModel(models.Model):
         if (update_fields is None or "modified_on" in update_fields) and not kwargs.pop("preserve_modified_on", False):
             self.modified_on = timezone.now()
 
-        return super(SmartModel, self).save(*args, **kwargs)
+        super(SmartModel, self).save(*args, **kwargs)
+
+        # invalidate any cached list pages of this model
+        bump_list_version(self.__class__, using=self._state.db)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get("using", args[0] if args else None) or router.db_for_write(self.__class__, instance=self)
+        deleted = super(SmartModel, self).delete(*args, **kwargs)
+
+        bump_list_version(self.__class__, using=using)
+        return deleted
 
     class Meta:
         abstract = True
 
+    # how many rows are read, prepared and created together during an import
+    import_chunk_size = 1000
+
+    # whether imports should stream their rows, returning ImportedRecords which only keeps primary keys in memory
+    import_streaming = False
+
+    # if set, imported rows are written in batches of this size using create_instances rather than create_instance
+    bulk_import_batch_size = None
+
+    # if set, chunks of rows are prepared in this many worker processes while this process writes them in order. Workers
+    # are separate Django processes with their own database connections, so prepare_fields and any import lookups only
+    # see committed data (not rows written earlier in this import, nor anything in an open transaction or test case),
+    # and only settings from the settings module rather than any overridden at runtime
+    import_workers = None
+
+    # whether each chunk of rows is committed in its own transaction along with a checkpoint saved on the import task,
+    # letting an interrupted import be resumed from its last committed row
+    import_checkpoints = False
+
+    # if set, imports report their progress every this many rows, saving their partial results on their task
+    import_progress_interval = None
+
+    # if set, no more than this many imports of this model are run at once by enqueue_import
+    import_concurrency = None
+
+    # the spreadsheet readers tried in order for an import file, files which none of them can read are read as CSV
+    import_readers = (XlsxReader, XlsReader)
+
     @classmethod
     def prepare_fields(cls, field_dict, import_params=None, user=None):
         return field_dict
@@ -67,80 +127,150 @@ class SmartModel(models.Model):
     def create_instance(cls, field_dict):
         return cls.objects.create(**field_dict)
 
+    @classmethod
+    def create_instances(cls, field_dicts):
+        """
+        Creates the records for a batch of imported rows when bulk_import_batch_size is set. Note that this uses
+        bulk_create so save() isn't called on the records. Models which override create_instance but not this have
+        their rows created one at a time by create_instance instead.
+        """
+        return cls.objects.bulk_create([cls(**field_dict) for field_dict in field_dicts])
+
     @classmethod
     def validate_import_header(cls, header):
+        """
+        Validates the header of an import file, raising an exception if it isn't valid. This can also return an
+        ImportColumnPlan to control how the values of each row are turned into field values.
+        """
         return
 
+    @classmethod
+    def derive_import_plan(cls, header, normalize=None):
+        """
+        Returns the ImportColumnPlan for an import with the passed in header, which is the plan returned by
+        validate_import_header if it returns one, otherwise a plan which uses every column as it is
+        """
+        plan = cls.validate_import_header(header)
+        if not isinstance(plan, ImportColumnPlan):
+            plan = ImportColumnPlan(header)
+
+        # plans returned by validate_import_header may be shared by other imports, so we never change them
+        return plan.copy(normalize)
+
+    @classmethod
+    def get_import_lookups(cls, import_params):
+        """
+        Returns ImportLookups for resolving the values of columns to related objects, keyed by column name. These are
+        passed to prepare_fields as import_params["lookups"] and the keys of each chunk of rows are prefetched together,
+        so preparing a row doesn't need a query of its own.
+        """
+        return {}
+
+    @classmethod
+    def with_import_lookups(cls, import_params):
+        """
+        Returns the passed in import params with our lookups added, or unchanged if we don't have any
+        """
+        lookups = cls.get_import_lookups(import_params)
+        if not lookups:
+            return import_params
+
+        return dict(import_params or {}, lookups=lookups)
+
     @classmethod
     def get_import_file_headers(cls, csv_file):
-        filename = csv_file
-        headers = []
+        """
+        Returns the normalized header of the passed in file or ImportSource. A source is left parsed, so that it can
+        then be passed to import_csv which will start reading straight from its data.
+        """
+        source = ImportSource.for_file(csv_file)
         try:
-            workbook = open_workbook(filename.name, "rb")
-
-            for sheet in workbook.sheets():
-                # read our header
-                header = []
-                for col in range(sheet.ncols):
-                    header.append(str(sheet.cell(0, col).value))
-                headers = [cls.normalize_value(_).lower() for _ in header]
-
-                # only care for the first sheet
-                break
-        except XLRDError:
-            # our alternative codec, by default we are the crazy windows encoding
-            ascii_codec = "cp1252"
-
-            # read the entire file, look for mac_roman characters
-            reader = open(filename.name, "rb")
-            for byte in reader.read():
-                # these are latin accented characterse in mac_roman, if we see them then our alternative
-                # encoding should be mac_roman
-                try:
-                    byte_number = ord(byte)
-                except TypeError:
-                    byte_number = byte
+            return list(cls.parse_import_source(source).header)
+        finally:
+            # only unmap sources we created, a source passed to us may still be used for its import
+            if source is not csv_file:
+                source.release()
 
-                if byte_number in [0x81, 0x8D, 0x8F, 0x90, 0x9D]:
-                    ascii_codec = "mac_roman"
-                    break
-            reader.close()
+    @classmethod
+    def parse_import_source(cls, source):
+        """
+        Works out the format of the passed in source and reads its header, recording both on the source. Files which
+        none of our spreadsheet readers can read are parsed as CSV. Sources which have already been parsed are left
+        as they are.
+        """
+        if source.parsed:
+            return source
 
-            reader = open(filename.name, "r", encoding="utf-8-sig")
+        for reader_class in cls.get_import_readers(source):
+            # readers which turn out not to be able to read the file leave it for the next reader to try
+            try:
+                reader = reader_class(cls, source)
+            except (XLRDError, UnreadableSpreadsheet):
+                continue
 
-            def unicode_csv_reader(utf8_data, dialect=csv.excel, **kwargs):
-                csv_reader = csv.reader(utf8_data, dialect=dialect, **kwargs)
-                for row in csv_reader:
-                    encoded = []
-                    for cell in row:
-                        try:
-                            cell = str(cell)
-                        except Exception:
-                            cell = str(cell.decode(ascii_codec))
+            source.format = reader.format
+            source.reader = reader
+            source.header = [cls.normalize_value(_).lower() for _ in reader.header()]
+            source.header_line = 1
+            return source
 
-                        encoded.append(cell)
+        return cls.parse_import_csv_source(source)
 
-                    yield encoded
+    @classmethod
+    def get_import_readers(cls, source):
+        """
+        Yields those of our spreadsheet readers which accept the passed in source, in the order they should be tried
+        """
+        for reader_class in cls.import_readers:
+            if reader_class.accepts(source):
+                yield reader_class
 
-            reader = unicode_csv_reader(reader)
+    @classmethod
+    def parse_import_csv_source(cls, source):
+        """
+        Reads the header of the passed in source as CSV, recording it on the source along with where its data starts
+        """
+        lines = source.text_lines()
+        reader = cls.csv_import_reader(lines, source.ascii_codec)
 
-            # read in our header
-            line_number = 0
+        # read in our header
+        line_number = 0
 
+        header = next(reader)
+        line_number += 1
+        while header is not None and len(header[0]) > 1 and header[0][0] == "#":
             header = next(reader)
             line_number += 1
-            while header is not None and len(header[0]) > 1 and header[0][0] == "#":
-                header = next(reader)
-                line_number += 1
 
-            # do some sanity checking to make sure they uploaded the right kind of file
-            if len(header) < 1:
-                raise Exception("Invalid header for import file")
+        # do some sanity checking to make sure they uploaded the right kind of file
+        if len(header) < 1:
+            raise Exception("Invalid header for import file")
+
+        # normalize our header names, removing quotes and spaces
+        source.format = "csv"
+        source.header = [cls.normalize_value(_).lower() for _ in header]
+        source.header_line = line_number
+        source.data_offset = lines.position
+        return source
+
+    @classmethod
+    def csv_import_reader(cls, lines, ascii_codec, dialect=csv.excel, **kwargs):
+        """
+        Returns a reader of the rows of the passed in lines of a CSV file, where ascii_codec is our alternative codec,
+        either the crazy windows encoding or mac_roman
+        """
+        csv_reader = csv.reader(lines, dialect=dialect, **kwargs)
+        for row in csv_reader:
+            encoded = []
+            for cell in row:
+                try:
+                    cell = str(cell)
+                except Exception:
+                    cell = str(cell.decode(ascii_codec))
 
-            # normalize our header names, removing quotes and spaces
-            headers = [cls.normalize_value(_).lower() for _ in header]
+                encoded.append(cell)
 
-        return headers
+            yield encoded
 
     @classmethod
     def finalize_import(cls, task, records):
@@ -151,30 +281,36 @@ class SmartModel(models.Model):
         return
 
     @classmethod
-    def import_csv(cls, task, log=None):
-        csv_file = task.csv_file
-        csv_file.open()
-
-        # this file isn't good enough, lets write it to local disk
-        import os
-        from uuid import uuid4
-
-        from django.conf import settings
-
-        # make sure our tmp directory is present (throws if already present)
-        try:
-            os.makedirs(os.path.join(settings.MEDIA_ROOT, "tmp"))
-        except Exception:
-            pass
+    def save_import_results(cls, task, import_results):
+        """
+        Saves the partial results of an import on its task. This is called as an import reports its progress and, for
+        imports with checkpoints, inside the transaction of each chunk so a checkpoint is only ever committed along with
+        the rows it covers.
+        """
+        task.import_results = json.dumps(import_results)
 
-        # write our file out
-        tmp_file = os.path.join(settings.MEDIA_ROOT, "tmp/%s" % str(uuid4()))
+        if hasattr(task, "save"):
+            task.save(update_fields=["import_results"])
 
-        out_file = open(tmp_file, "wb")
-        out_file.write(csv_file.read())
-        out_file.close()
+    @classmethod
+    def enqueue_import(cls, task):
+        """
+        Queues the import of the passed in task to be run in the background by the import runner named by our
+        SMARTMIN_IMPORT_RUNNER setting, returning a handle whose result will be the number of records imported.
+        Queued imports always use checkpoints, so their progress can be seen as they run and retries resume from
+        the last committed chunk.
+        """
+        return get_import_runner().submit(ImportJob(cls, task))
 
-        filename = out_file
+    @classmethod
+    def import_csv(cls, task, log=None, progress=None, source=None, checkpoints=None):
+        """
+        Imports the file of the passed in task. If progress is given, it's called with an ImportProgress every
+        import_progress_interval rows, or every chunk of rows if that isn't set. If source is given, it's an
+        ImportSource of the task's file, e.g. one already passed to get_import_file_headers, whose format and header
+        aren't worked out again. It's released but left for the caller to close. If checkpoints is given, it overrides
+        import_checkpoints for this import. Imports with checkpoints return the records created by all their runs.
+        """
         user = task.created_by
 
         import_params = None
@@ -187,12 +323,63 @@ class SmartModel(models.Model):
             except Exception:
                 pass
 
+        if checkpoints is None:
+            checkpoints = cls.import_checkpoints
+
+        checkpoint = None
+        if checkpoints:
+            # pick up from wherever a previous run of this import got to
+            checkpoint = ImportCheckpoint.from_results(
+                task.import_results, on_commit=lambda results: cls.save_import_results(task, results)
+            )
+
+            # a finished import has nothing left to read, so running it again just returns what it created
+            if checkpoint.finished:
+                if source is not None:
+                    source.release()
+
+                records = checkpoint.get_records(cls, cls.import_chunk_size)
+                return records if cls.import_streaming else list(records)
+
+        # get our upload onto local disk, streaming it there if our storage doesn't already keep it there
+        own_source = source is None
+        if own_source:
+            source = ImportSource.from_upload(task.csv_file)
+
+        import_progress = None
+        if progress or cls.import_progress_interval:
+
+            def report_progress(import_progress):
+                cls.save_import_results(task, import_progress.results)
+                if progress:
+                    progress(import_progress)
+
+            import_progress = ImportProgress(report_progress, cls.import_progress_interval or cls.import_chunk_size)
+
         try:
-            records = cls.import_xls(filename, user, import_params, log, import_results)
-        except XLRDError:
-            records = cls.import_raw_csv(filename, user, import_params, log, import_results)
+            cls.parse_import_source(source)
+
+            if source.format == "csv":
+                records = cls.import_raw_csv(
+                    source, user, import_params, log, import_results, checkpoint=checkpoint, progress=import_progress
+                )
+            else:
+                reader_class = next(r for r in cls.import_readers if r.format == source.format)
+                records = cls.import_spreadsheet(
+                    reader_class,
+                    source,
+                    user,
+                    import_params,
+                    log,
+                    import_results,
+                    checkpoint=checkpoint,
+                    progress=import_progress,
+                )
         finally:
-            os.remove(tmp_file)
+            if own_source:
+                source.close()
+            else:
+                source.release()
 
         task.import_results = json.dumps(import_results)
 
@@ -214,67 +401,60 @@ class SmartModel(models.Model):
         return val
 
     @classmethod
-    def import_xls(cls, filename, user, import_params, log=None, import_results=None):
-        workbook = open_workbook(filename.name, "rb")
-
+    @classmethod
+    def get_import_timezone(cls, import_params):
         # timezone for date cells can be specified as an import parameter or defaults to UTC
         # use now to determine a relevant timezone
         naive_timezone = (
             zoneinfo.ZoneInfo(import_params["timezone"]) if import_params and "timezone" in import_params else tzone.utc
         )
-        tz = timezone.now().astimezone(naive_timezone).tzinfo
-
-        records = []
-        num_errors = 0
-        error_messages = []
-
-        for sheet in workbook.sheets():
-            # read our header
-            header = []
-            for col in range(sheet.ncols):
-                header.append(str(sheet.cell(0, col).value))
-            header = [cls.normalize_value(_).lower() for _ in header]
-
-            cls.validate_import_header(header)
-
-            # read our rows
-            line_number = 1
-            for row in range(sheet.nrows - 1):
-                field_values = []
-                for col in range(sheet.ncols):
-                    cell = sheet.cell(row + 1, col)
-                    field_values.append(cls.get_cell_value(workbook, tz, cell))
+        return timezone.now().astimezone(naive_timezone).tzinfo
 
-                field_values = dict(zip(header, field_values))
-                field_values["created_by"] = user
-                field_values["modified_by"] = user
-
-                try:
-                    field_values = cls.prepare_fields(field_values, import_params, user)
-                    record = cls.create_instance(field_values)
-
-                    if record:
-                        records.append(record)
-                    else:
-                        num_errors += 1
-
-                except SmartImportRowError as e:
-                    error_messages.append(dict(line=line_number + 1, error=str(e)))
+    @classmethod
+    def import_spreadsheet(
+        cls, reader_class, filename, user, import_params, log=None, import_results=None, checkpoint=None, progress=None
+    ):
+        source = ImportSource.for_file(filename)
+
+        # use the reader our header was read with if our source has already been parsed
+        if isinstance(source.reader, reader_class):
+            reader, header = source.reader, source.header
+            source.reader = None
+        else:
+            reader = reader_class(cls, source)
+            header = [cls.normalize_value(_).lower() for _ in reader.header()]
 
-                except Exception as e:
-                    if log:
-                        traceback.print_exc(100, log)
-                    raise Exception("Line %d: %s\n\n%s" % (line_number, str(e), field_values))
-                line_number += 1
-            # only care about the first sheet
-            break
+        try:
+            # only the first sheet is read
+            plan = cls.derive_import_plan(header)
+
+            # skip any rows already committed by a previous run, row indexes are one less than their line numbers
+            first_row = max(checkpoint.line, 1) if checkpoint else 1
+
+            return cls.import_rows(
+                plan,
+                reader.rows(cls.get_import_timezone(import_params), first_row),
+                user,
+                import_params,
+                log,
+                import_results,
+                checkpoint=checkpoint,
+                progress=progress,
+            )
+        finally:
+            reader.close()
 
-        if import_results is not None:
-            import_results["records"] = len(records)
-            import_results["errors"] = num_errors + len(error_messages)
-            import_results["error_messages"] = error_messages
+    @classmethod
+    def import_xls(cls, filename, user, import_params, log=None, import_results=None, checkpoint=None, progress=None):
+        return cls.import_spreadsheet(
+            XlsReader, filename, user, import_params, log, import_results, checkpoint=checkpoint, progress=progress
+        )
 
-        return records
+    @classmethod
+    def import_xlsx(cls, filename, user, import_params, log=None, import_results=None, checkpoint=None, progress=None):
+        return cls.import_spreadsheet(
+            XlsxReader, filename, user, import_params, log, import_results, checkpoint=checkpoint, progress=progress
+        )
 
     @classmethod
     def get_cell_value(cls, workbook, tz, cell):
@@ -285,101 +465,296 @@ class SmartModel(models.Model):
             return cls.normalize_value(str(cell.value))
 
     @classmethod
-    def import_raw_csv(cls, filename, user, import_params, log=None, import_results=None):
-        # our alternative codec, by default we are the crazy windows encoding
-        ascii_codec = "cp1252"
-
-        # read the entire file, look for mac_roman characters
-        reader = open(filename.name, "rb")
-        for byte in reader.read():
-            # these are latin accented characterse in mac_roman, if we see them then our alternative
-            # encoding should be mac_roman
-            try:
-                byte_number = ord(byte)
-            except TypeError:
-                byte_number = byte
+    def get_column_values(cls, workbook, tz, values, types):
+        """
+        Converts the cells of a column of an .xls sheet, given as lists of their values and types. The result is the
+        same as calling get_cell_value for each cell, but date cells are converted all at once. Models which override
+        get_cell_value still have it called for each cell.
+        """
+        if getattr(cls.get_cell_value, "__func__", None) is not SmartModel.get_cell_value.__func__:
+            return [cls.get_cell_value(workbook, tz, Cell(ctype, value)) for ctype, value in zip(types, values)]
 
-            if byte_number in [0x81, 0x8D, 0x8F, 0x90, 0x9D]:
-                ascii_codec = "mac_roman"
-                break
-        reader.close()
+        normalize = cls.normalize_value
 
-        reader = open(filename.name, "r", encoding="utf-8-sig")
+        dated = [index for index, ctype in enumerate(types) if ctype == XL_CELL_DATE]
+        if not dated:
+            return [normalize(str(value)) for value in values]
 
-        def unicode_csv_reader(utf8_data, dialect=csv.excel, **kwargs):
-            csv_reader = csv.reader(utf8_data, dialect=dialect, **kwargs)
-            for row in csv_reader:
-                encoded = []
-                for cell in row:
-                    try:
-                        cell = str(cell)
-                    except Exception:
-                        cell = str(cell.decode(ascii_codec))
+        converted = [value if ctype == XL_CELL_DATE else normalize(str(value)) for value, ctype in zip(values, types)]
+        dates = convert_xldates([values[index] for index in dated], workbook.datemode, tz)
 
-                    encoded.append(cell)
+        for index, value in zip(dated, dates):
+            # anything which can't be converted in bulk, like a time without a date, is left to get_cell_value
+            if value is None:
+                value = cls.get_cell_value(workbook, tz, Cell(XL_CELL_DATE, values[index]))
+            converted[index] = value
 
-                yield encoded
+        return converted
 
-        reader = unicode_csv_reader(reader)
+    @classmethod
+    def get_xlsx_cell_value(cls, tz, value):
+        """
+        Converts the value of a cell read by openpyxl, which has already turned date cells into naive datetimes
+        """
+        if isinstance(value, datetime):
+            return value.replace(tzinfo=tz)
+        elif isinstance(value, date):
+            return datetime(value.year, value.month, value.day, tzinfo=tz)
+        elif value is None:
+            return ""
+        else:
+            return cls.normalize_value(str(value))
 
-        # read in our header
-        line_number = 0
+    @classmethod
+    def import_raw_csv(
+        cls, filename, user, import_params, log=None, import_results=None, checkpoint=None, progress=None
+    ):
+        source = ImportSource.for_file(filename)
+        if source.format != "csv":
+            cls.parse_import_csv_source(source)
 
-        header = next(reader)
-        line_number += 1
-        while header is not None and len(header[0]) > 1 and header[0][0] == "#":
-            header = next(reader)
-            line_number += 1
+        header = source.header
 
-        # do some sanity checking to make sure they uploaded the right kind of file
-        if len(header) < 1:
-            raise Exception("Invalid header for import file")
+        # values are trimmed as they are turned into field values, that way dropped columns are never trimmed
+        plan = cls.derive_import_plan(header, normalize=cls.normalize_value)
 
-        # normalize our header names, removing quotes and spaces
-        header = [cls.normalize_value(_).lower() for _ in header]
+        # start reading straight from the rows after our header, or after any rows already committed by a previous run
+        line_number, offset = source.header_line, source.data_offset
+        if checkpoint and checkpoint.offset is not None:
+            line_number, offset = checkpoint.line, checkpoint.offset
 
-        cls.validate_import_header(header)
+        lines = source.text_lines(offset=offset)
+        reader = cls.csv_import_reader(lines, source.ascii_codec)
 
-        records = []
-        num_errors = 0
-        error_messages = []
+        def csv_rows(line_number):
+            for row in reader:
+                line_number += 1
 
-        for row in list(reader):
-            # trim all our values
-            row = [cls.normalize_value(_) for _ in row]
+                # make sure there are same number of fields
+                if len(row) != len(header):
+                    raise Exception(
+                        "Line %d: The number of fields for this row is incorrect. Expected %d but found %d."
+                        % (line_number, len(header), len(row))
+                    )
+
+                if checkpoint:
+                    checkpoint.mark(line_number, lines.position)
+
+                yield line_number, row
+
+        return cls.import_rows(
+            plan,
+            csv_rows(line_number),
+            user,
+            import_params,
+            log,
+            import_results,
+            checkpoint=checkpoint,
+            progress=progress,
+        )
 
-            line_number += 1
+    @classmethod
+    def prepare_import_rows(cls, plan, rows, user, import_params):
+        """
+        Builds and prepares the field values for an iterable of (line number, values) tuples using the passed in column
+        plan. For each row this yields a tuple of its line number, its field values, the message of any
+        SmartImportRowError and the message and traceback of any other exception. This is also what import workers
+        run, so must not depend on earlier rows having been created, or on any other uncommitted data, when import_workers
+        is set. Any lookups in the import params are prefetched for all the passed in rows first.
+        """
+        build = plan.compile(dict(created_by=user, modified_by=user))
 
-            # make sure there are same number of fields
-            if len(row) != len(header):
-                raise Exception(
-                    "Line %d: The number of fields for this row is incorrect. Expected %d but found %d."
-                    % (line_number, len(header), len(row))
-                )
+        lookups = import_params.get("lookups") if isinstance(import_params, dict) else None
+        if lookups:
+            rows = list(rows)
+            prefetch_lookups(lookups, plan, rows)
+
+        for line_number, values in rows:
+            field_values = values
+            row_error = None
+            exception = None
 
-            field_values = dict(zip(header, row))
-            field_values["created_by"] = user
-            field_values["modified_by"] = user
             try:
+                field_values = build(values)
                 field_values = cls.prepare_fields(field_values, import_params, user)
-                record = cls.create_instance(field_values)
-                if record:
-                    records.append(record)
-                else:
-                    num_errors += 1
 
             except SmartImportRowError as e:
-                error_messages.append(dict(line=line_number, error=str(e)))
+                row_error = str(e)
 
             except Exception as e:
-                if log:
-                    traceback.print_exc(100, log)
-                raise Exception("Line %d: %s\n\n%s" % (line_number, str(e), field_values))
+                exception = (str(e), traceback.format_exc(100))
+
+            yield line_number, field_values, row_error, exception
+
+    @classmethod
+    def import_rows(
+        cls, header, rows, user, import_params, log=None, import_results=None, checkpoint=None, progress=None
+    ):
+        """
+        Creates records from an iterable of (line number, values) tuples, where header is either a list of column
+        names or an ImportColumnPlan. Rows are consumed lazily a chunk at a time
+        so that a large file is never held in memory in its entirety. If given a checkpoint, each chunk is committed in
+        its own transaction which also moves the checkpoint forward, and results carry on from those of the
+        checkpoint. If given an ImportProgress, it's updated after each chunk.
+        """
+        records = ImportedRecords(cls, cls.import_chunk_size)
+
+        num_errors = 0
+        error_messages = []
+        previous_records = 0
+
+        if checkpoint:
+            # carry on from the records committed by earlier runs, counting any which predate checkpoints having keys
+            records = checkpoint.get_records(cls, cls.import_chunk_size)
+            error_messages = list(checkpoint.error_messages)
+            num_errors = checkpoint.errors - len(error_messages)
+            previous_records = checkpoint.records - len(records)
+
+        if not cls.import_streaming:
+            records = list(records)
+
+        # how many of our records are already covered by our checkpoint
+        committed = restored = len(records)
+
+        def results():
+            # errors are reported in file order even if they were found while creating a batch
+            return dict(
+                records=previous_records + len(records),
+                errors=num_errors + len(error_messages),
+                error_messages=sorted(error_messages, key=lambda error: error["line"]),
+            )
+
+        def partial_results():
+            partial = results()
+            if checkpoint:
+                partial["checkpoint"] = checkpoint.as_json()
+            return partial
+
+        def row_exception(line_number, e, field_values):
+            if log:
+                traceback.print_exc(100, log)
+            return Exception("Line %d: %s\n\n%s" % (line_number, str(e), field_values))
+
+        def create_batch(batch):
+            nonlocal num_errors
+
+            # try writing the whole batch at once, if that fails we fall back to creating its rows one at a time so
+            # that errors are still reported against the right lines
+            if bulk_create:
+                try:
+                    with transaction.atomic():
+                        created = cls.create_instances([field_values for line_number, field_values in batch])
+                except DatabaseError:
+                    created = None
+
+                if created is not None:
+                    for record in created:
+                        if record:
+                            records.append(record)
+                        else:
+                            num_errors += 1
+                    return
+
+            for line_number, field_values in batch:
+                try:
+                    record = cls.create_instance(field_values)
+
+                    if record:
+                        records.append(record)
+                    else:
+                        num_errors += 1
+
+                except SmartImportRowError as e:
+                    error_messages.append(dict(line=line_number, error=str(e)))
+
+                except Exception as e:
+                    raise row_exception(line_number, e, field_values)
+
+        # rows are only written in bulk if that won't bypass a create_instance which the model has overridden
+        overrides_create_instance = (
+            getattr(cls.create_instance, "__func__", None) is not SmartModel.create_instance.__func__
+        )
+        overrides_create_instances = (
+            getattr(cls.create_instances, "__func__", None) is not SmartModel.create_instances.__func__
+        )
+        bulk_create = cls.bulk_import_batch_size and (overrides_create_instances or not overrides_create_instance)
+
+        plan = header if isinstance(header, ImportColumnPlan) else ImportColumnPlan(header)
+        batch_size = cls.bulk_import_batch_size if bulk_create else 1
+
+        parallel = cls.import_workers and cls.import_workers > 1
+
+        if parallel and not plan.is_picklable():
+            logger.warning(
+                "Preparing rows of %s import in this process as its column plan can't be sent to worker processes, "
+                "use module level functions rather than lambdas as converters",
+                cls._meta.label,
+            )
+            parallel = False
+
+        if parallel:
+            prepared_chunks = prepare_import_chunks_parallel(
+                cls, plan, rows, user, import_params, cls.import_workers, cls.import_chunk_size
+            )
+        else:
+            prepare_params = cls.with_import_lookups(import_params)
+            prepared_chunks = (
+                cls.prepare_import_rows(plan, chunk, user, prepare_params)
+                for chunk in chunk_list(rows, cls.import_chunk_size)
+            )
+
+        rows_read = 0
+
+        for prepared_rows in prepared_chunks:
+            with transaction.atomic() if checkpoint else nullcontext():
+                batch = []
+                last_line = None
+
+                for line_number, field_values, row_error, exception in prepared_rows:
+                    last_line = line_number
+                    rows_read += 1
+
+                    if row_error is not None:
+                        error_messages.append(dict(line=line_number, error=row_error))
+
+                    elif exception is not None:
+                        message, formatted_traceback = exception
+                        if log:
+                            log.write(formatted_traceback)
+                        raise Exception("Line %d: %s\n\n%s" % (line_number, message, field_values))
+
+                    else:
+                        batch.append((line_number, field_values))
+
+                    if len(batch) >= batch_size:
+                        create_batch(batch)
+                        batch = []
+
+                if batch:
+                    create_batch(batch)
+
+                if checkpoint and last_line is not None:
+                    if isinstance(records, ImportedRecords):
+                        pks = records.pks[committed:]
+                    else:
+                        pks = [record.pk for record in records[committed:]]
+
+                    checkpoint.commit(last_line, results(), pks)
+                    committed = len(records)
+
+            if progress:
+                progress.update(rows_read, partial_results)
+
+        # a finished import has nothing left to resume, running it again just returns its records
+        if checkpoint:
+            checkpoint.finished = True
 
         if import_results is not None:
-            import_results["records"] = len(records)
-            import_results["errors"] = num_errors + len(error_messages)
-            import_results["error_messages"] = error_messages
+            import_results.update(partial_results())
+
+        # records are bulk created so our save() isn't called to invalidate cached list pages
+        if len(records) > restored:
+            bump_list_version(cls, using=router.db_for_write(cls))
 
         return records
 
@@ -0,0 +1,306 @@
+"""
+Pagination for SmartListView, with counts which can be capped or estimated for large tables, and keyset pagination
+which needs no counts at all.
+"""
+
+import base64
+import binascii
+import json
+import operator
+from functools import reduce
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.paginator import EmptyPage, InvalidPage, Page, Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+
+
+class PageObjects(list):
+    """
+    The objects of a page which have already been read, e.g. from our cache. Like the querysets of other pages, they
+    know their model, which is what templates use to style lists.
+    """
+
+    def __init__(self, objects, model):
+        super().__init__(objects)
+        self.model = model
+
+
+class ExactCount(object):
+    """
+    Counts every object, which is always right but can take seconds on large tables
+    """
+
+    def count(self, queryset):
+        """
+        Returns the count of the passed in queryset and whether it is exact
+        """
+        return queryset.count(), True
+
+    def label(self, count, exact):
+        return str(count)
+
+
+class CappedCount(ExactCount):
+    """
+    Counts objects up to a limit, so lists with more than that are shown as having e.g. 1000+
+    """
+
+    def __init__(self, limit=1000):
+        self.limit = limit
+
+    def count(self, queryset):
+        count = queryset[: self.limit + 1].count()
+        return (count, True) if count <= self.limit else (self.limit, False)
+
+    def label(self, count, exact):
+        return str(count) if exact else "%d+" % count
+
+
+class EstimatedCount(ExactCount):
+    """
+    Uses the Postgres planner's estimate of how many objects there are, from the statistics in pg_class if the
+    queryset isn't filtered, otherwise by explaining its query. Estimates below the threshold are replaced by exact
+    counts as they are cheap, as are estimates on other databases, which don't have them.
+    """
+
+    def __init__(self, threshold=10000):
+        self.threshold = threshold
+
+    def count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return super().count(queryset)
+
+        query = queryset.query
+        with connection.cursor() as cursor:
+            if not query.where and not query.distinct and not query.combinator:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+                estimate = row[0] if row else -1
+            else:
+                sql, params = query.get_compiler(using=queryset.db).as_sql()
+                cursor.execute("EXPLAIN (FORMAT JSON) %s" % sql, params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = plan[0]["Plan"]["Plan Rows"]
+
+        # tables which have never been analyzed have no estimate
+        if estimate < self.threshold:
+            return super().count(queryset)
+
+        return int(estimate), False
+
+    def label(self, count, exact):
+        return str(count) if exact else "~%d" % count
+
+
+COUNT_STRATEGIES = {"exact": ExactCount, "capped": CappedCount, "estimated": EstimatedCount}
+
+
+class SmartPaginator(Paginator):
+    """
+    Paginator whose count comes from a count strategy. When that count isn't exact we can't trust it to tell us how
+    many pages there are, so pages past it can still be asked for and whether there is a next page is found by
+    reading one more object than fits on each page.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count_strategy=None, **kwargs):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page, **kwargs)
+        self.count_strategy = count_strategy or ExactCount()
+        self.count_exact = True
+
+    @cached_property
+    def count(self):
+        count, self.count_exact = self.count_strategy.count(self.object_list)
+        return count
+
+    @property
+    def count_label(self):
+        return self.count_strategy.label(self.count, self.count_exact)
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if self.count_exact or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_exact:
+            return super().page(number)
+
+        bottom = (number - 1) * self.per_page
+        objects = list(self.object_list[bottom : bottom + self.per_page + 1])
+        if not objects and number > 1:
+            raise EmptyPage(self.error_messages["no_results"])
+
+        return InexactPage(
+            PageObjects(objects[: self.per_page], self.object_list.model),
+            number,
+            self,
+            has_next=len(objects) > self.per_page,
+        )
+
+
+class InexactPage(Page):
+    """
+    Page of a paginator without an exact count, which knows whether there is a next page from what it read
+    """
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def end_index(self):
+        return (self.number - 1) * self.paginator.per_page + len(self.object_list)
+
+
+class KeysetPaginator(object):
+    """
+    Pages through a queryset by seeking past the ordering values of the last object of the previous page rather than
+    by offset, so that pages deep into large tables are as fast as the first and no count is needed. Pages are
+    identified by opaque cursors, which are the encoded ordering values of an object.
+
+    The queryset is paged in its current ordering with its primary key added as a tie-breaker. That ordering must be
+    made up of field names, which shouldn't be nullable as NULLs can't be compared to seek past them.
+    """
+
+    # lets templates tell us apart from numbered paginators
+    keyset = True
+
+    def __init__(self, queryset, per_page):
+        self.per_page = int(per_page)
+        self.ordering = self.derive_ordering(queryset)
+
+        # annotate our queryset with the values we order by so they can be read from objects and filtered on
+        aliases = {"_keyset_%d" % i: field for i, (field, descending) in enumerate(self.ordering)}
+        self.aliases = list(aliases)
+        self.queryset = queryset.annotate(**{alias: F(field) for alias, field in aliases.items()})
+
+    @staticmethod
+    def derive_ordering(queryset):
+        """
+        Returns the ordering of the passed in queryset as a list of field and whether it is descending tuples, with the
+        primary key added if it isn't already there
+        """
+        query = queryset.query
+        ordering = list(query.order_by) or (list(queryset.model._meta.ordering) if query.default_ordering else [])
+
+        fields = []
+        for order in ordering:
+            if not isinstance(order, str) or order == "?":
+                raise ImproperlyConfigured("Keyset pagination requires ordering by field names, not %s" % order)
+
+            fields.append((order.lstrip("-"), order.startswith("-")))
+
+        pk_names = ("pk", queryset.model._meta.pk.name, queryset.model._meta.pk.attname)
+        if not any(field in pk_names for field, descending in fields):
+            fields.append(("pk", fields[-1][1] if fields else False))
+
+        return fields
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, alias) for alias in self.aliases]
+        cursor = json.dumps(values, default=str, separators=(",", ":"))
+        return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii").rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise InvalidPage("Invalid cursor")
+
+        if not isinstance(values, list) or len(values) != len(self.aliases):
+            raise InvalidPage("Invalid cursor")
+
+        return values
+
+    def seek(self, values, backwards):
+        """
+        Returns the filter for objects which come after the passed in ordering values, or before them if backwards
+        """
+        clauses = []
+        for i, alias in enumerate(self.aliases):
+            descending = self.ordering[i][1] != backwards
+            clause = {"%s__%s" % (alias, "lt" if descending else "gt"): values[i]}
+            clause.update({self.aliases[j]: values[j] for j in range(i)})
+            clauses.append(Q(**clause))
+
+        return reduce(operator.or_, clauses)
+
+    def order(self, backwards):
+        return [
+            ("-%s" if descending != backwards else "%s") % alias
+            for alias, (field, descending) in zip(self.aliases, self.ordering)
+        ]
+
+    def page(self, after=None, before=None):
+        """
+        Returns the page which follows the object with the after cursor, precedes the object with the before cursor,
+        or if neither is given, the first page
+        """
+        backwards = bool(before) and not after
+        queryset = self.queryset.order_by(*self.order(backwards))
+
+        cursor = after or before
+        if cursor:
+            try:
+                queryset = queryset.filter(self.seek(self.decode_cursor(cursor), backwards))
+            except (TypeError, ValueError, ValidationError):
+                raise InvalidPage("Invalid cursor")
+
+        objects = list(queryset[: self.per_page + 1])
+        has_more = len(objects) > self.per_page
+        objects = objects[: self.per_page]
+
+        if backwards:
+            objects.reverse()
+            return KeysetPage(objects, self, has_next=True, has_previous=has_more)
+        else:
+            return KeysetPage(objects, self, has_next=has_more, has_previous=bool(cursor))
+
+
+class KeysetPage(object):
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = PageObjects(object_list, paginator.queryset.model)
+        self.paginator = paginator
+
+        # we can only link to the pages either side of us if we have objects to take cursors from
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+
+    def __repr__(self):
+        return "<Keyset page of %d>" % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[len(self.object_list) - 1]) if self._has_next else None
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[0]) if self._has_previous else None
@@ -0,0 +1,180 @@
+"""
+Profiling of requests to SmartViews, turned on for all views with the SMARTMIN_VIEW_PROFILING setting or for single
+views with their profiling attribute. Each phase of a profiled request is timed and has its database queries counted,
+and the results are added to the response as a Server-Timing header, logged and added to the stats of the view.
+"""
+
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# the phases of a request in the order they're reported, with dispatch covering the four phases which follow it
+PHASES = ("dispatch", "permission", "pre_process", "context", "render", "template")
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class ViewProfile(object):
+    """
+    The profile of a single request to a view
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.phases = {}
+        self.finished = False
+
+    @property
+    def view_name(self):
+        return "%s.%s" % (self.view.__class__.__module__, self.view.__class__.__qualname__)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the enclosed code and counts the queries it makes, adding them to the passed in phase
+        """
+        counter = QueryCounter()
+        start = time.perf_counter()
+
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(counter))
+                yield
+        finally:
+            elapsed, queries = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (elapsed + time.perf_counter() - start, queries + counter.count)
+
+    def wrap(self, name, func):
+        """
+        Returns the passed in function wrapped so that calls to it are added to the passed in phase
+        """
+
+        def wrapped(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+
+        return wrapped
+
+    def profile_response(self, response):
+        """
+        Profiles the rendering of the passed in response if it hasn't been rendered yet, otherwise finishes our profile
+        """
+        if getattr(response, "is_rendered", True):
+            self.finish(response)
+            return response
+
+        render = response.render
+
+        def profiled_render():
+            with self.phase("template"):
+                rendered = render()
+
+            # responses are pickled by cache middleware, which they can't be with our function stuck on them
+            response.__dict__.pop("render", None)
+
+            self.finish(rendered)
+            return rendered
+
+        response.render = profiled_render
+        return response
+
+    def finish(self, response):
+        if self.finished:
+            return
+        self.finished = True
+
+        # our total is everything up to and including rendering our template
+        dispatch_elapsed, dispatch_queries = self.phases.get("dispatch", (0.0, 0))
+        template_elapsed, template_queries = self.phases.get("template", (0.0, 0))
+        self.phases["total"] = (dispatch_elapsed + template_elapsed, dispatch_queries + template_queries)
+
+        timings = []
+        for name in ("total",) + PHASES:
+            if name in self.phases:
+                elapsed, queries = self.phases[name]
+                timings.append('%s;dur=%.1f;desc="%d queries"' % (name, elapsed * 1000, queries))
+        response["Server-Timing"] = ", ".join(timings)
+
+        phases = {
+            name: dict(ms=round(elapsed * 1000, 1), queries=queries) for name, (elapsed, queries) in self.phases.items()
+        }
+        view_stats.record(self.view_name, self.view.url_name, self.phases)
+
+        logger.info(
+            "%s took %.1fms with %d queries",
+            self.view_name,
+            phases["total"]["ms"],
+            phases["total"]["queries"],
+            extra=dict(view=self.view_name, url_name=self.view.url_name, status=response.status_code, phases=phases),
+        )
+
+
+class ViewStats(object):
+    """
+    The combined profiles of every request made to each view in this process, by view and URL name
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, view_name, url_name, phases):
+        with self.lock:
+            stats = self.stats.setdefault((view_name, url_name), dict(requests=0, phases={}))
+            stats["requests"] += 1
+
+            for name, (elapsed, queries) in phases.items():
+                phase = stats["phases"].setdefault(name, dict(ms=0.0, max_ms=0.0, queries=0, max_queries=0))
+                phase["ms"] += elapsed * 1000
+                phase["max_ms"] = max(phase["max_ms"], elapsed * 1000)
+                phase["queries"] += queries
+                phase["max_queries"] = max(phase["max_queries"], queries)
+
+    def as_json(self):
+        """
+        Returns the stats of each view, slowest in total first, with their average and worst times and query counts
+        """
+        views = []
+        with self.lock:
+            for (view_name, url_name), stats in self.stats.items():
+                requests = stats["requests"]
+                phases = {
+                    name: dict(
+                        avg_ms=round(phase["ms"] / requests, 1),
+                        max_ms=round(phase["max_ms"], 1),
+                        avg_queries=round(phase["queries"] / requests, 1),
+                        max_queries=phase["max_queries"],
+                    )
+                    for name, phase in stats["phases"].items()
+                }
+                views.append(
+                    dict(
+                        view=view_name,
+                        url_name=url_name,
+                        requests=requests,
+                        total_ms=round(stats["phases"]["total"]["ms"], 1),
+                        phases=phases,
+                    )
+                )
+
+        return sorted(views, key=lambda v: -v["total_ms"])
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+
+view_stats = ViewStats()
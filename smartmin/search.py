@@ -0,0 +1,127 @@
+"""
+Backends which SmartListView uses to filter lists by the search_fields of the view. Searches with LIKE clauses can't
+use normal indexes, so on Postgres the trigram and full-text backends search in ways which can use GIN indexes. The
+indexes each backend needs can be added to a model's Meta.indexes with search_indexes, e.g.
+
+    indexes = search_indexes(("title__icontains", "body__icontains"), "post_search", backend="fulltext")
+"""
+
+import operator
+from functools import reduce
+
+from django.db import connections
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast, Upper
+
+# lookups which can end search fields, stripped off to get the fields themselves
+SEARCH_LOOKUPS = ("exact", "iexact", "contains", "icontains", "startswith", "istartswith", "search")
+
+
+def search_field_path(search_field):
+    """
+    Returns the field path of the passed in search field, e.g. created_by__username for created_by__username__iexact
+    """
+    path, sep, lookup = search_field.rpartition("__")
+    return path if sep and lookup in SEARCH_LOOKUPS else search_field
+
+
+class LikeSearch(object):
+    """
+    Matches objects where each term of the search matches at least one of the search fields, using the lookups given
+    in the search fields, e.g. title__icontains
+    """
+
+    def derive_lookups(self, search_fields):
+        return search_fields
+
+    def search(self, queryset, search_fields, search_query):
+        """
+        Returns the passed in queryset filtered by the passed in search query
+        """
+        lookups = self.derive_lookups(search_fields)
+
+        term_queries = []
+        for term in search_query.split(" "):
+            field_queries = []
+            for field in lookups:
+                field_queries.append(Q(**{field: term}))
+            term_queries.append(reduce(operator.or_, field_queries))
+
+        return queryset.filter(reduce(operator.and_, term_queries))
+
+    def indexes(self, search_fields, name):
+        """
+        Returns the indexes which speed up searches of the passed in fields, named from the passed in name
+        """
+        return []
+
+
+class TrigramSearch(LikeSearch):
+    """
+    Searches every field with icontains, which on Postgres can use trigram indexes. These need the pg_trgm extension,
+    which can be installed with a TrigramExtension migration operation.
+    """
+
+    def derive_lookups(self, search_fields):
+        return ["%s__icontains" % search_field_path(field) for field in search_fields]
+
+    def indexes(self, search_fields, name):
+        from django.contrib.postgres.indexes import GinIndex, OpClass
+
+        # Postgres runs icontains as UPPER(field::text) LIKE UPPER(term), so that's what we index
+        return [
+            GinIndex(
+                OpClass(Upper(Cast(search_field_path(field), TextField())), name="gin_trgm_ops"),
+                name="%s_%d" % (name, i),
+            )
+            for i, field in enumerate(search_fields)
+        ]
+
+
+class FullTextSearch(LikeSearch):
+    """
+    Uses Postgres full-text search, matching objects where the text of the search fields contains the words of the
+    search. Searches support quoted phrases, OR and -excluded words. Other databases fall back to LIKE searches.
+    """
+
+    def __init__(self, config="simple", search_type="websearch"):
+        self.config = config
+        self.search_type = search_type
+
+    def vector(self, search_fields):
+        from django.contrib.postgres.search import SearchVector
+
+        return SearchVector(*[search_field_path(field) for field in search_fields], config=self.config)
+
+    def search(self, queryset, search_fields, search_query):
+        if connections[queryset.db].vendor != "postgresql":
+            return super().search(queryset, search_fields, search_query)
+
+        from django.contrib.postgres.search import SearchQuery
+
+        query = SearchQuery(search_query, config=self.config, search_type=self.search_type)
+        return queryset.alias(_search_vector=self.vector(search_fields)).filter(_search_vector=query)
+
+    def indexes(self, search_fields, name):
+        from django.contrib.postgres.indexes import GinIndex
+
+        # this must be the same expression as we search on for Postgres to use it
+        return [GinIndex(self.vector(search_fields), name=name)]
+
+
+SEARCH_BACKENDS = {"like": LikeSearch, "trigram": TrigramSearch, "fulltext": FullTextSearch}
+
+
+def get_search_backend(backend):
+    """
+    Returns the passed in backend if it is one, otherwise the backend with the passed in name
+    """
+    return SEARCH_BACKENDS[backend]() if isinstance(backend, str) else backend
+
+
+def search_indexes(search_fields, name, backend="fulltext"):
+    """
+    Returns the indexes which speed up searches of the passed in fields by the passed in backend, for adding to the
+    Meta.indexes of their model so that makemigrations creates them
+    """
+    return get_search_backend(backend).indexes(search_fields, name)
@@ -0,0 +1,33 @@
+from celery import shared_task
+
+from django.conf import settings
+
+from .jobs import ExportJob, ImportJob, acquire_import_slot, release_import_slot
+
+
+@shared_task(bind=True, name="smartmin.run_import_job", max_retries=None)
+def run_import_job(self, job_json):
+    """
+    Runs an import job queued by CeleryImportRunner, retrying it later if its model is already running as many
+    imports as it allows. Eager jobs are run by whatever submits them so aren't limited.
+    """
+    job = ImportJob.from_json(job_json)
+
+    slot = acquire_import_slot(job.model) if not self.request.is_eager else ""
+    if slot is None:
+        raise self.retry(countdown=getattr(settings, "SMARTMIN_IMPORT_RETRY_DELAY", 30))
+
+    try:
+        records = job.run()
+    finally:
+        release_import_slot(slot)
+
+    return len(records)
+
+
+@shared_task(name="smartmin.run_export_job")
+def run_export_job(job_json):
+    """
+    Runs an export job queued by CeleryImportRunner, returning the name of the exported file
+    """
+    return ExportJob.from_json(job_json).run()
@@ -1,5 +1,8 @@
-import operator
-from functools import reduce
+import hashlib
+import json
+import tempfile
+from collections import namedtuple
+from functools import lru_cache, partial
 from urllib.parse import quote as urlquote
 
 import django.forms.models as model_forms
@@ -7,10 +10,12 @@ from django import forms
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.core.cache import cache
 from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.paginator import InvalidPage, Page
 from django.db import IntegrityError
-from django.db.models import Q
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import re_path, reverse
 from django.utils.encoding import force_str
 from django.utils.http import url_has_allowed_host_and_scheme
@@ -20,6 +25,20 @@ from django.views.generic.base import TemplateView
 from django.views.generic.edit import CreateView, FormView, ModelFormMixin, ProcessFormView, UpdateView
 
 from . import widgets
+from .caching import get_list_version, register_cached_list
+from .exports import SPREADSHEET_WRITERS
+from .jobs import ExportJob, get_export_state, get_import_runner
+from .pagination import (
+    COUNT_STRATEGIES,
+    CappedCount,
+    EstimatedCount,
+    InexactPage,
+    KeysetPaginator,
+    PageObjects,
+    SmartPaginator,
+)
+from .profiling import ViewProfile
+from .search import get_search_backend
 
 
 def smart_url(url, obj=None):
@@ -43,6 +62,61 @@ def smart_url(url, obj=None):
             return url % obj.id
 
 
+# what we show of a model field, with the verbose name and help text left lazy so that they're translated when used
+FieldMetadata = namedtuple("FieldMetadata", ("verbose_name", "help_text", "orderable"))
+
+
+@lru_cache(maxsize=None)
+def get_field_metadata(model):
+    """
+    Returns the metadata of the fields of the passed in model by name, which is only built once for each model
+    """
+    # only these fields have labels and help text looked up from the model
+    local_fields = {field.name for field in model._meta.fields}
+
+    metadata = {}
+    for field in model._meta.get_fields():
+        # m2ms and reverse relations aren't orderable as they would require joins that duplicate rows
+        orderable = field.concrete and not field.many_to_many
+
+        if field.name in local_fields:
+            metadata[field.name] = FieldMetadata(field.verbose_name, field.help_text, orderable)
+
+            # columns of foreign keys can be ordered by, but their labels are still derived from their names
+            if field.attname != field.name:
+                metadata[field.attname] = FieldMetadata(None, None, orderable)
+        else:
+            metadata[field.name] = FieldMetadata(None, None, orderable)
+
+    return metadata
+
+
+def attribute_chain(field):
+    """
+    Returns a function which looks up the passed in field on objects, following dotted fields through related
+    objects, calling any attributes which are callable and stopping at the first which is empty
+    """
+    if field.find(".") >= 0:
+        names = field.split(".")
+    else:
+        names = [field.encode("ascii", "ignore").decode("utf-8")]
+
+    def lookup(obj):
+        for name in names:
+            obj = getattr(obj, name, None)
+
+            # if it is callable, do so
+            if obj and getattr(obj, "__call__", None):
+                obj = obj()
+
+            if not obj:
+                break
+
+        return obj
+
+    return lookup
+
+
 class SmartView:
     fields = None
     exclude = None
@@ -52,6 +126,9 @@ class SmartView:
     template_name = None
     pjax = None
 
+    # whether requests to this view are profiled, None to use the SMARTMIN_VIEW_PROFILING setting
+    profiling = None
+
     # set by our CRUDL
     url_name = None
 
@@ -110,7 +187,26 @@ class SmartView:
                 else:
                     return response
 
-        return wrapper(request, *args, **kwargs)
+        if not self.derive_profiling():
+            return wrapper(request, *args, **kwargs)
+
+        # profile each phase of this request by wrapping its methods on this instance, so that overrides are included
+        profile = ViewProfile(self)
+        self.has_permission = profile.wrap("permission", self.has_permission)
+        self.pre_process = profile.wrap("pre_process", self.pre_process)
+        self.get_context_data = profile.wrap("context", self.get_context_data)
+        self.render_to_response = profile.wrap("render", self.render_to_response)
+
+        with profile.phase("dispatch"):
+            response = wrapper(request, *args, **kwargs)
+
+        return profile.profile_response(response)
+
+    def derive_profiling(self):
+        """
+        Returns whether requests to this view should be profiled
+        """
+        return self.profiling if self.profiling is not None else getattr(settings, "SMARTMIN_VIEW_PROFILING", False)
 
     def pre_process(self, request, *args, **kwargs):
         """
@@ -127,24 +223,42 @@ class SmartView:
         Looks for a field's value from the passed in obj.  Note that this will strip
         leading attributes to deal with subelements if possible
         """
-        curr_field = field.encode("ascii", "ignore").decode("utf-8")
-        rest = None
+        return attribute_chain(field)(obj)
 
-        if field.find(".") >= 0:
-            curr_field = field.split(".")[0]
-            rest = ".".join(field.split(".")[1:])
+    def get_field_accessor(self, field):
+        """
+        Returns the function which looks up the value of the passed in field for an object, which is either our own
+        get_ method for it or a lookup of its attributes. These are only worked out once for each field per request.
+        """
+        accessors = getattr(self, "_field_accessors", None)
+        if accessors is None:
+            accessors = self._field_accessors = {}
 
-        # next up is the object itself
-        obj_field = getattr(obj, curr_field, None)
+        accessor = accessors.get(field)
+        if accessor is None:
+            # if this isn't a subfield, check the view to see if it has a get_ method
+            if field.find(".") == -1:
+                accessor = getattr(self, "get_%s" % field.encode("ascii", "ignore").decode("utf-8"), None)
 
-        # if it is callable, do so
-        if obj_field and getattr(obj_field, "__call__", None):
-            obj_field = obj_field()
+            if not accessor:
+                if type(self).lookup_obj_attribute is SmartView.lookup_obj_attribute:
+                    accessor = attribute_chain(field)
+                else:
+                    accessor = partial(self.lookup_obj_attribute, field=field)
 
-        if obj_field and rest:
-            return self.lookup_obj_attribute(obj_field, rest)
-        else:
-            return obj_field
+            accessors[field] = accessor
+
+        return accessor
+
+    def derive_field_accessors(self, fields):
+        """
+        Returns the functions which look up the values of the passed in fields for an object, for use when rendering
+        many objects. Views which override lookup_field_value have it called for every value.
+        """
+        if type(self).lookup_field_value is not SmartView.lookup_field_value:
+            return [partial(self.lookup_field_value, dict(), field=field) for field in fields]
+
+        return [self.get_field_accessor(field) for field in fields]
 
     def lookup_field_value(self, context, obj, field):
         """
@@ -156,16 +270,7 @@ class SmartView:
         This may be used for example to change the display value of a variable depending on
         other variables within our context.
         """
-        curr_field = field.encode("ascii", "ignore").decode("utf-8")
-
-        # if this isn't a subfield, check the view to see if it has a get_ method
-        if field.find(".") == -1:
-            # view supercedes all, does it have a 'get_' method for this obj
-            view_method = getattr(self, "get_%s" % curr_field, None)
-            if view_method:
-                return view_method(obj)
-
-        return self.lookup_obj_attribute(obj, field)
+        return self.get_field_accessor(field)(obj)
 
     def lookup_field_label(self, context, field, default=None):
         """
@@ -191,9 +296,9 @@ class SmartView:
 
         # check our model
         else:
-            for model_field in self.model._meta.fields:
-                if model_field.name == field:
-                    return model_field.verbose_name.title()
+            metadata = get_field_metadata(self.model).get(field)
+            if metadata and metadata.verbose_name is not None:
+                return metadata.verbose_name.title()
 
         # otherwise, derive it from our field name
         if label is None:
@@ -216,11 +321,10 @@ class SmartView:
             help = default
 
         # try to see if there is a description on our model
-        elif hasattr(self, "model"):
-            for model_field in self.model._meta.fields:
-                if model_field.name == field:
-                    help = model_field.help_text
-                    break
+        elif getattr(self, "model", None):
+            metadata = get_field_metadata(self.model).get(field)
+            if metadata and metadata.help_text is not None:
+                help = metadata.help_text
 
         return help
 
@@ -318,7 +422,7 @@ class SmartView:
         url_params = "?"
         order_params = ""
         for key in self.request.GET.keys():
-            if key != "page" and key != "pjax" and (len(key) == 0 or key[0] != "_"):
+            if key not in ("page", "page_after", "page_before", "pjax") and (len(key) == 0 or key[0] != "_"):
                 for value in self.request.GET.getlist(key):
                     url_params += "%s=%s&" % (urlquote(key), urlquote(value))
             elif key == "_order":
@@ -506,10 +610,44 @@ class SmartListView(SmartView, ListView):
     link_fields = None
     add_button = None
     search_fields = None
+    search_backend = "like"
     paginate_by = 25
     field_config = {"is_active": dict(label="")}
     default_order = None
     select_related = None
+    prefetch_related = None
+
+    # whether to select and prefetch the relations our fields follow, and to only load the columns they use
+    auto_related = False
+    auto_only = False
+
+    # how many objects are read at a time by exports of all of our objects
+    export_chunk_size = 2000
+
+    # how many seconds each page of this list is cached for, None to not cache them
+    list_cache_timeout = None
+
+    # whether this list is paged with page_after and page_before cursors rather than page numbers, which stays fast
+    # deep into large tables as it needs neither offsets nor a count
+    paginate_keyset = False
+
+    # how the total count of this list is found, one of "exact", "capped", "estimated" or "auto", which estimates the
+    # count of the whole list but caps it when searching, or an instance of a count strategy
+    paginator_class = SmartPaginator
+    count_strategy = "exact"
+    count_cap = 1000
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        """
+        Overloaded to register our model as having cached lists if we cache our pages, so that saving its instances
+        invalidates them
+        """
+        model = initkwargs.get("model", cls.model)
+        if model and initkwargs.get("list_cache_timeout", cls.list_cache_timeout):
+            register_cached_list(model)
+
+        return super().as_view(**initkwargs)
 
     @classmethod
     def derive_url_pattern(cls, path, action):
@@ -524,6 +662,12 @@ class SmartListView(SmartView, ListView):
         """
         return self.search_fields
 
+    def derive_search_backend(self):
+        """
+        Derives the backend our searches are run by
+        """
+        return get_search_backend(self.search_backend)
+
     def derive_title(self):
         """
         Derives our title from our list
@@ -566,10 +710,8 @@ class SmartListView(SmartView, ListView):
         """
         model = self.model if self.model else self.object_list.model
 
-        try:
-            return model._meta.get_field(field).concrete
-        except FieldDoesNotExist:
-            return False
+        metadata = get_field_metadata(model).get(field)
+        return metadata.orderable if metadata else False
 
     def get_context_data(self, **kwargs):
         """
@@ -599,8 +741,107 @@ class SmartListView(SmartView, ListView):
 
         return context
 
+    def get_field_relations(self):
+        """
+        Returns the relations and columns our fields need, as returned by derive_field_relations, which are only worked
+        out once per request
+        """
+        relations = getattr(self, "_field_relations", None)
+        if relations is None:
+            relations = self._field_relations = self.derive_field_relations()
+        return relations
+
+    def derive_field_relations(self):
+        """
+        Works out how to load what our fields need from the database, returning the relations to select, the relations
+        to prefetch and the columns to load. Fields with get_ methods on this view are assumed to only use their own
+        column if they have one. Columns can't be worked out for fields which are properties of our model, in which
+        case the returned columns are None.
+        """
+        model = self.model if self.model else self.queryset.model
+        select, prefetch, columns, whole = [], [], [model._meta.pk.name], set()
+
+        # our list template greys out inactive objects
+        if any(f.name == "is_active" for f in model._meta.fields):
+            columns.append("is_active")
+
+        for field in self.derive_fields():
+            parts = field.split(".")
+
+            if len(parts) == 1 and getattr(self, "get_%s" % field, None):
+                try:
+                    if model._meta.get_field(field).concrete:
+                        columns.append(field)
+                except FieldDoesNotExist:
+                    pass
+                continue
+
+            curr_model, path = model, []
+            for part in parts:
+                try:
+                    model_field = curr_model._meta.get_field(part)
+                except FieldDoesNotExist:
+                    # a property or method, which could use any of the columns of its object
+                    if path:
+                        whole.add("__".join(path))
+                    else:
+                        columns = None
+                    break
+
+                path.append(part)
+
+                if model_field.many_to_many or model_field.one_to_many:
+                    prefetch.append("__".join(path))
+                    break
+                elif model_field.is_relation:
+                    select.append("__".join(path))
+                    curr_model = model_field.related_model
+
+                    # related objects at the end of a field are displayed as a whole
+                    if len(path) == len(parts):
+                        whole.add("__".join(path))
+                else:
+                    if columns is not None:
+                        columns.append("__".join(path))
+                    break
+
+        def unique(paths):
+            return list(dict.fromkeys(paths))
+
+        # we only need to select the deepest relations as selecting them selects the ones they go through
+        select = [p for p in unique(select) if not any(s.startswith(p + "__") for s in select)]
+
+        if columns is not None:
+            # relations which are selected must be loaded, and those used as a whole loaded in full
+            columns = [c for c in columns + select if not any(c.startswith(w + "__") for w in whole)]
+            columns = unique(columns + sorted(whole))
+
+        return select, unique(prefetch), columns
+
     def derive_select_related(self):
-        return self.select_related
+        """
+        Returns the relations to select with our objects, which if auto_related is set includes those our fields follow
+        """
+        related = list(self.select_related or [])
+        if self.auto_related:
+            related += [r for r in self.get_field_relations()[0] if r not in related]
+        return related
+
+    def derive_prefetch_related(self):
+        """
+        Returns the relations to prefetch for our objects, which if auto_related is set includes the many-to-many and
+        reverse relations in our fields
+        """
+        related = list(self.prefetch_related or [])
+        if self.auto_related:
+            related += [r for r in self.get_field_relations()[1] if r not in related]
+        return related
+
+    def derive_only(self):
+        """
+        Returns the only columns to load for our objects, which if auto_only is set are those which our fields use
+        """
+        return self.get_field_relations()[2] if self.auto_only else None
 
     def derive_queryset(self, **kwargs):
         """
@@ -613,20 +854,23 @@ class SmartListView(SmartView, ListView):
         search_fields = self.derive_search_fields()
         search_query = self.request.GET.get("search")
         if search_fields and search_query:
-            term_queries = []
-            for term in search_query.split(" "):
-                field_queries = []
-                for field in search_fields:
-                    field_queries.append(Q(**{field: term}))
-                term_queries.append(reduce(operator.or_, field_queries))
-
-            queryset = queryset.filter(reduce(operator.and_, term_queries))
+            queryset = self.derive_search_backend().search(queryset, search_fields, search_query)
 
         # add any select related
         related = self.derive_select_related()
         if related:
             queryset = queryset.select_related(*related)
 
+        # and prefetch related
+        prefetch = self.derive_prefetch_related()
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+
+        # and limit what columns we load
+        only = self.derive_only()
+        if only:
+            queryset = queryset.only(*only)
+
         # return our queryset
         return queryset
 
@@ -674,6 +918,114 @@ class SmartListView(SmartView, ListView):
 
         return queryset
 
+    def derive_list_cache_key(self):
+        """
+        Returns the key the current page of this list is cached under. This is made up of the version of our model,
+        this view, its URL arguments, the query parameters which filter, order and page it and the permissions of the
+        user. Lists which also depend on something else, e.g. on who the user is, should override this to include it.
+        """
+        model = self.object_list.model
+
+        params = dict(self.request.GET.lists())
+        params.pop("pjax", None)
+        params.pop("_format", None)
+        if "search" in params:
+            params["search"] = [" ".join(term.split()) for term in params["search"]]
+
+        permissions = sorted(self.request.user.get_all_permissions()) if self.request.user.is_authenticated else []
+
+        view = "%s.%s" % (self.__class__.__module__, self.__class__.__qualname__)
+        identity = json.dumps([view, self.args, self.kwargs, params, permissions], sort_keys=True, default=str)
+
+        return "smartmin:list:%s:%s:%s" % (
+            model._meta.label_lower,
+            get_list_version(model),
+            hashlib.md5(identity.encode("utf-8")).hexdigest(),
+        )
+
+    def derive_count_strategy(self):
+        """
+        Returns the count strategy for our list, choosing between estimating and capping it if we're set to auto
+        """
+        strategy = self.count_strategy
+
+        if strategy == "auto":
+            searching = self.derive_search_fields() and self.request.GET.get("search")
+            return CappedCount(self.count_cap) if searching else EstimatedCount()
+        elif strategy == "capped":
+            return CappedCount(self.count_cap)
+        elif isinstance(strategy, str):
+            return COUNT_STRATEGIES[strategy]()
+        else:
+            return strategy
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        if issubclass(self.paginator_class, SmartPaginator):
+            kwargs["count_strategy"] = self.derive_count_strategy()
+
+        return super().get_paginator(queryset, per_page, orphans, allow_empty_first_page, **kwargs)
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Overloaded to read the current page and the total count of our list from our cache if we have list_cache_timeout
+        set, and to cache them if they aren't there yet.
+        """
+        if self.paginate_keyset:
+            return self.paginate_queryset_keyset(queryset, page_size)
+
+        if not self.list_cache_timeout:
+            return super().paginate_queryset(queryset, page_size)
+
+        register_cached_list(queryset.model)
+
+        key = self.derive_list_cache_key()
+        cached = cache.get(key)
+
+        if cached is None:
+            paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+            count_exact = getattr(paginator, "count_exact", True)
+            cached = (paginator.count, count_exact, page.number, page.has_next(), list(object_list))
+            cache.set(key, cached, self.list_cache_timeout)
+            return paginator, page, object_list, is_paginated
+
+        count, count_exact, number, has_next, objects = cached
+        paginator = self.get_paginator(
+            queryset, page_size, orphans=self.get_paginate_orphans(), allow_empty_first_page=self.get_allow_empty()
+        )
+        paginator.count = count
+        paginator.count_exact = count_exact
+
+        object_list = PageObjects(objects, queryset.model)
+        if count_exact:
+            page = Page(object_list, number, paginator)
+        else:
+            page = InexactPage(object_list, number, paginator, has_next)
+
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def paginate_queryset_keyset(self, queryset, page_size):
+        """
+        Pages our queryset in its current ordering, plus primary key, starting after the object with the page_after
+        cursor or ending before the object with the page_before cursor
+        """
+        paginator = KeysetPaginator(queryset, page_size)
+
+        try:
+            page = paginator.page(after=self.request.GET.get("page_after"), before=self.request.GET.get("page_before"))
+        except InvalidPage as e:
+            raise Http404(_("Invalid page: %(message)s") % {"message": str(e)})
+
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def iterate_objects(self):
+        """
+        Iterates over all our objects in chunks of export_chunk_size, without our queryset holding on to them
+        """
+        if hasattr(self.object_list, "iterator"):
+            return self.object_list.iterator(chunk_size=self.export_chunk_size)
+        else:
+            return iter(self.object_list)
+
     def derive_fields(self):
         """
         Derives our fields.
@@ -683,7 +1035,8 @@ class SmartListView(SmartView, ListView):
 
         else:
             fields = []
-            for field in self.object_list.model._meta.fields:
+            model = self.model if self.model else self.object_list.model
+            for field in model._meta.fields:
                 if field.name != "id":
                     fields.append(field.name)
             return fields
@@ -720,22 +1073,143 @@ class SmartListView(SmartView, ListView):
             has_more = context["page_obj"].has_next() if context["page_obj"] else False
 
             json_data = dict(results=results, err="nil", more=has_more)
+
+            # keyset paged lists also give the cursor of the next page, to be passed back as page_after
+            if has_more and self.paginate_keyset:
+                json_data["page_after"] = context["page_obj"].next_cursor
+
             return JsonResponse(json_data)
         # otherwise, return normally
         else:
             return super(SmartListView, self).render_to_response(context)
 
 
-class SmartCsvView(SmartListView):
+class CsvLineBuffer(object):
+    """
+    File-like object for csv writers which just hands back each line written, so lines can be streamed
+    """
+
+    def write(self, line):
+        return line
+
+
+class SmartExportMixin(object):
+    """
+    Lets exports be run as background jobs by the import runner rather than in the request, for exports too large to
+    finish before it times out. Requests to export redirect to a page which refreshes until the export is done and
+    then links to the file, which is saved to our default storage and can only be downloaded by whoever exported it.
+    """
+
+    # whether exports are run in the background rather than returned in the response
+    export_async = False
+
+    # how many milliseconds the page of an export waits before checking again whether it's done
+    export_refresh = 2000
+
+    def get(self, request, *args, **kwargs):
+        export_id = request.GET.get("export")
+        if export_id:
+            return self.render_export(export_id)
+
+        if self.export_async:
+            job = ExportJob.create(request)
+            get_import_runner().submit(job)
+            return HttpResponseRedirect("%s?export=%s" % (request.path, job.export_id))
+
+        return super().get(request, *args, **kwargs)
+
+    def render_export(self, export_id):
+        """
+        Renders the state of the passed in export, or its file if it's complete and being downloaded
+        """
+        state = get_export_state(export_id)
+        if not state or state["user_id"] != self.request.user.pk:
+            raise Http404("No such export")
+
+        if "_download" in self.request.GET:
+            if state["status"] != "complete":
+                raise Http404("Export isn't complete")
+
+            return FileResponse(
+                default_storage.open(state["file"], "rb"), as_attachment=True, filename=state["filename"]
+            )
+
+        download_url = "%s?export=%s&_download=1" % (self.request.path, export_id)
+
+        if self.request.GET.get("_format") == "json":
+            json_data = dict(id=export_id, status=state["status"], error=state.get("error"))
+            json_data["url"] = download_url if state["status"] == "complete" else None
+            return JsonResponse(json_data)
+
+        # our page shows no objects, but is rendered like our list so that it can refresh like one
+        self.object_list = self.get_queryset().none()
+        context = self.get_context_data(export=state, export_id=export_id, download_url=download_url)
+        context["refresh"] = self.export_refresh if state["status"] in ("queued", "running") else 0
+
+        return self.response_class(
+            request=self.request, template=["smartmin/export.html"], context=context, using=self.template_engine
+        )
+
+    def write_export(self, file):  # pragma: no cover
+        """
+        Writes our export to the passed in binary file
+        """
+        raise NotImplementedError()
+
+
+class SmartCsvView(SmartExportMixin, SmartListView):
+    # whether our CSV is streamed as it's written rather than built in memory first
+    streaming = False
+
     def derive_filename(self):
         filename = getattr(self, "filename", None)
         if not filename:
             filename = "%s.csv" % self.model._meta.verbose_name.lower()
         return filename
 
+    def get_paginate_by(self, queryset):
+        """
+        Streamed exports don't need a page of their objects, or the count of them paging requires
+        """
+        return None if self.streaming else super().get_paginate_by(queryset)
+
+    def stream_csv(self, fields):
+        """
+        Yields our CSV, starting with its header row and then rows for each chunk of our objects as they are read
+        """
+        import csv
+
+        writer = csv.writer(CsvLineBuffer(), quoting=csv.QUOTE_ALL)
+
+        yield writer.writerow([str(self.lookup_field_label(dict(), field)) for field in fields])
+
+        accessors = self.derive_field_accessors(fields)
+
+        lines = []
+        for obj in self.iterate_objects():
+            lines.append(writer.writerow([str(accessor(obj)) for accessor in accessors]))
+
+            if len(lines) >= self.export_chunk_size:
+                yield "".join(lines)
+                lines = []
+
+        if lines:
+            yield "".join(lines)
+
+    def write_export(self, file):
+        for chunk in self.stream_csv(self.derive_fields()):
+            file.write(chunk.encode("utf-8"))
+
     def render_to_response(self, context, **response_kwargs):
         import csv
 
+        if self.streaming:
+            response = StreamingHttpResponse(
+                self.stream_csv(self.derive_fields()), content_type="text/csv; charset=utf-8"
+            )
+            response["Content-Disposition"] = "attachment; filename=%s" % self.derive_filename()
+            return response
+
         # Create the HttpResponse object with the appropriate CSV header.
         response = HttpResponse(content_type="text/csv; charset=utf-8")
         response["Content-Disposition"] = "attachment; filename=%s" % self.derive_filename()
@@ -751,47 +1225,62 @@ class SmartCsvView(SmartListView):
         writer.writerow(header)
 
         # then our actual values
+        accessors = self.derive_field_accessors(fields)
         for obj in self.object_list:
-            row = []
-            for field in fields:
-                row.append(str(self.lookup_field_value(dict(), obj, field)))
-            writer.writerow(row)
+            writer.writerow([str(accessor(obj)) for accessor in accessors])
 
         return response
 
 
-class SmartXlsView(SmartListView):
+class SmartXlsView(SmartExportMixin, SmartListView):
+    # the format of our spreadsheet, either "xls" or "xlsx" which needs openpyxl
+    export_format = "xls"
+
     def derive_filename(self):
         filename = getattr(self, "filename", None)
         if not filename:
-            filename = "%s.xls" % self.model._meta.verbose_name.lower()
+            filename = "%s.%s" % (self.model._meta.verbose_name.lower(), self.export_format)
         return filename
 
-    def render_to_response(self, context, **response_kwargs):
-        from xlwt import Workbook
+    def get_paginate_by(self, queryset):
+        """
+        Exports don't need a page of their objects, or the count of them paging requires
+        """
+        return None
 
-        book = Workbook()
-        sheet1 = book.add_sheet(self.derive_title())
+    def write_spreadsheet(self, file):
+        """
+        Writes all our objects as a spreadsheet to the passed in file, iterating over them once and starting new sheets
+        whenever one is full. Returns the writer used.
+        """
         fields = self.derive_fields()
+        header = [str(self.lookup_field_label(dict(), field)) for field in fields]
 
-        # build up our header row
-        for col in range(len(fields)):
-            field = fields[col]
-            sheet1.write(0, col, str(self.lookup_field_label(dict(), field)))
+        accessors = self.derive_field_accessors(fields)
 
-        # then our actual values
-        for row in range(len(self.object_list)):
-            obj = self.object_list[row]
-            for col in range(len(fields)):
-                field = fields[col]
-                value = str(self.lookup_field_value(dict(), obj, field))
-                # skip the header
-                sheet1.write(row + 1, col, value)
-
-        # Create the HttpResponse object with the appropriate header.
-        response = HttpResponse(content_type="application/vnd.ms-excel")
+        writer = SPREADSHEET_WRITERS[self.export_format](str(self.derive_title()), header)
+        for obj in self.iterate_objects():
+            writer.write_row([str(accessor(obj)) for accessor in accessors])
+
+        writer.save(file)
+        return writer
+
+    def write_export(self, file):
+        self.write_spreadsheet(file)
+
+    def render_to_response(self, context, **response_kwargs):
+        # spreadsheets are saved to a temporary file which our response then streams from
+        output = tempfile.TemporaryFile()
+        try:
+            writer = self.write_spreadsheet(output)
+        except Exception:
+            output.close()
+            raise
+
+        output.seek(0)
+
+        response = FileResponse(output, content_type=writer.content_type)
         response["Content-Disposition"] = "attachment; filename=%s" % self.derive_filename()
-        book.save(response)
         return response
 
 
@@ -884,11 +1373,8 @@ class SmartFormMixin(object):
 
         if meta_labels and field in meta_labels:
             default = meta_labels[field]
-        else:
-            for form_field in self.form:
-                if form_field.name == field:
-                    default = form_field.label
-                    break
+        elif field in self.form.fields:
+            default = self.form[field].label
 
         return super(SmartFormMixin, self).lookup_field_label(context, field, default=default)
 
@@ -906,11 +1392,8 @@ class SmartFormMixin(object):
 
         if meta_help_texts and field in meta_help_texts:
             default = meta_help_texts[field]
-        else:
-            for form_field in self.form:
-                if form_field.name == field:
-                    default = form_field.help_text
-                    break
+        elif field in self.form.fields:
+            default = self.form[field].help_text
 
         return super(SmartFormMixin, self).lookup_field_help(field, default=default)
 
@@ -0,0 +1,161 @@
+import csv
+import os
+import resource
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import xlwt
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from test_runner.blog.models import Post
+
+# the most rows a sheet in an .xls workbook can have, including its header
+XLS_MAX_ROWS = 65536
+
+HEADER = ("title", "body", "order", "tags")
+
+
+def generate_row(index):
+    return ("Post %d" % index, "The body of post number %d" % index, index % 100, "tag%d benchmark" % (index % 10))
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(HEADER)
+        for index in range(rows):
+            writer.writerow(generate_row(index))
+
+
+def write_xls(path, rows):
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet("Posts")
+
+    for col, value in enumerate(HEADER):
+        sheet.write(0, col, value)
+
+    for index in range(rows):
+        for col, value in enumerate(generate_row(index)):
+            sheet.write(index + 1, col, value)
+
+    workbook.save(path)
+
+
+def write_xlsx(path, rows):
+    from openpyxl import Workbook
+
+    # write only workbooks stream rows to disk so even a million rows are written in constant memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Posts")
+    sheet.append(HEADER)
+    for index in range(rows):
+        sheet.append(generate_row(index))
+
+    workbook.save(path)
+
+
+WRITERS = {"csv": write_csv, "xls": write_xls, "xlsx": write_xlsx}
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in megabytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports bytes, everything else kilobytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class QueryCounter:
+    """
+    Database execute wrapper which counts queries without needing DEBUG to be on
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks importing synthetic CSV and Excel files of posts into the configured database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            nargs="+",
+            default=[1000, 100000, 1000000],
+            help="The numbers of rows to benchmark, run smallest first as peak RSS only ever grows.",
+        )
+        parser.add_argument(
+            "--formats", nargs="+", choices=sorted(WRITERS), default=["csv", "xls", "xlsx"], help="The file formats."
+        )
+        parser.add_argument("--chunk-size", type=int, help="Overrides Post.import_chunk_size.")
+        parser.add_argument("--batch-size", type=int, help="Overrides Post.bulk_import_batch_size.")
+        parser.add_argument("--workers", type=int, help="Overrides Post.import_workers.")
+        parser.add_argument("--streaming", action="store_true", help="Streams imported records.")
+
+    def handle(self, *args, **options):
+        overrides = {"import_streaming": options["streaming"]}
+        if options["chunk_size"]:
+            overrides["import_chunk_size"] = options["chunk_size"]
+        if options["batch_size"]:
+            overrides["bulk_import_batch_size"] = options["batch_size"]
+        if options["workers"]:
+            overrides["import_workers"] = options["workers"]
+
+        user, _ = User.objects.get_or_create(username="benchmark")
+        if Post.objects.filter(created_by=user).exists():
+            raise CommandError("Posts by the benchmark user already exist, delete them before benchmarking")
+
+        self.stdout.write("Benchmarking imports on %s with %s" % (connection.vendor, overrides))
+        self.stdout.write(
+            "%-6s %10s %10s %12s %10s %10s" % ("format", "rows", "seconds", "rows/sec", "queries", "peak MB")
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for rows in sorted(options["rows"]):
+                for fmt in options["formats"]:
+                    if fmt == "xls" and rows >= XLS_MAX_ROWS:
+                        self.stdout.write("%-6s %10d skipped, too many rows for an .xls sheet" % (fmt, rows))
+                        continue
+
+                    path = os.path.join(tmp_dir, "posts_%d.%s" % (rows, fmt))
+                    WRITERS[fmt](path, rows)
+
+                    try:
+                        self.benchmark(fmt, path, rows, user, overrides)
+                    finally:
+                        Post.objects.filter(created_by=user).delete()
+                        os.remove(path)
+
+    def benchmark(self, fmt, path, rows, user, overrides):
+        counter = QueryCounter()
+
+        with open(path, "rb") as csv_file:
+            task = SimpleNamespace(csv_file=File(csv_file), created_by=user, import_params=None, import_results=None)
+
+            with patch.multiple(Post, **overrides), connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                records = Post.import_csv(task)
+                elapsed = time.perf_counter() - start
+
+        if len(records) != rows:
+            raise CommandError(
+                "Expected %d records from %s but got %d: %s" % (rows, fmt, len(records), task.import_results)
+            )
+
+        self.stdout.write(
+            "%-6s %10d %10.2f %12.0f %10d %10.1f" % (fmt, rows, elapsed, rows / elapsed, counter.count, peak_rss())
+        )
@@ -1,5 +1,6 @@
 import uuid
 
+from django.contrib.auth.models import User
 from django.db import models
 from django.utils.timezone import now
 
@@ -48,3 +49,14 @@ class Post(SmartModel):
 
 class Category(SmartModel):
     name = models.SlugField(max_length=64, unique=True, help_text="The name of this category")
+
+
+class ImportTask(models.Model):
+    """
+    An uploaded file to be imported, run in the background by Post.enqueue_import
+    """
+
+    csv_file = models.FileField(upload_to="imports")
+    import_params = models.TextField(null=True, blank=True)
+    import_results = models.TextField(null=True, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.PROTECT)
@@ -1,30 +1,77 @@
+import io
 import json
-from datetime import datetime, timedelta, timezone as tzone
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone as tzone
+from types import SimpleNamespace
 from unittest.mock import patch
 from zoneinfo import ZoneInfo
 
+import xlwt
+from xlrd import open_workbook, xldate_as_tuple
+from xlrd.xldate import XLDateAmbiguous, XLDateError
+
 from django import forms
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import Group, User
 from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
 from django.db.models import F, Value
 from django.db.models.functions import Concat
+from django.http import HttpResponse
 from django.test import RequestFactory, TestCase, override_settings
 from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 import smartmin
+from smartmin.caching import bump_list_version, cached_list_models, list_version_key
+from smartmin.exports import XlsWriter, XlsxWriter
+from smartmin.imports import (
+    ImportCheckpoint,
+    ImportColumnPlan,
+    ImportedRecords,
+    ImportLookup,
+    ImportSource,
+    UnreadableSpreadsheet,
+    XlsReader,
+    XlsxReader,
+    convert_xldates,
+    detect_ascii_codec,
+)
+from smartmin.jobs import (
+    ExportJob,
+    ImportJob,
+    LocalImportRunner,
+    acquire_import_slot,
+    delete_expired_exports,
+    get_export_state,
+    release_import_slot,
+)
 from smartmin.models import SmartImportRowError
+from smartmin.pagination import CappedCount, EstimatedCount, ExactCount
 from smartmin.perms import update_group_permissions
+from smartmin.profiling import view_stats
+from smartmin.search import FullTextSearch, LikeSearch, TrigramSearch, search_field_path, search_indexes
 from smartmin.templatetags.smartmin import get, get_value_from_view, user_as_string, view_as_json
 from smartmin.tests import SmartminTest
 from smartmin.users.models import FailedLogin, PasswordHistory, RecoveryToken, is_password_complex
-from smartmin.views import SmartFormView, smart_url
+from smartmin.views import SmartFormView, SmartListView, get_field_metadata, smart_url
 from smartmin.widgets import DatePickerWidget, ImageThumbnailWidget, VisibleHiddenWidget
-from test_runner.blog.models import Category, Post
+from test_runner import celery_app
+from test_runner.blog.models import Category, ImportTask, Post
 
 from .views import PostCRUDL, UserCRUDL
 
@@ -432,6 +479,463 @@ class PostTest(SmartminTest):
         self.assertEqual(response.context["url_params"], "?=x&foo=bar&")
         self.assertEqual(response.context["order_params"], "_order=-title&")
 
+    def test_list_cache(self):
+        cache.clear()
+
+        post1 = Post.objects.create(
+            title="A First Post", body="Apples", order=3, tags="post", created_by=self.author, modified_by=self.author
+        )
+
+        self.client.login(username="author", password="author")
+        list_url = reverse("blog.post_list")
+
+        with patch.object(PostCRUDL.List, "list_cache_timeout", 60):
+            response = self.client.get(list_url)
+            self.assertEqual(list(response.context["post_list"]), [post1, self.post])
+            self.assertEqual(response.context["paginator"].count, 2)
+
+            # updates which bypass save() aren't seen until our cached page expires
+            Post.objects.filter(id=post1.id).update(title="A Renamed Post")
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(list_url)
+
+            self.assertEqual(["A First Post", "Test Post"], [p.title for p in response.context["post_list"]])
+            self.assertEqual(response.context["paginator"].count, 2)
+            self.assertEqual(response.context["page_obj"].number, 1)
+            self.assertFalse([q for q in queries.captured_queries if "blog_post" in q["sql"]])
+
+            # but different searches, orderings and pages are cached separately
+            response = self.client.get(list_url + "?search=renamed")
+            self.assertEqual(list(response.context["post_list"]), [post1])
+            response = self.client.get(list_url + "?search=%20renamed%20")
+            self.assertEqual(list(response.context["post_list"]), [post1])
+            response = self.client.get(list_url + "?_order=-title")
+            self.assertEqual(["Test Post", "A Renamed Post"], [p.title for p in response.context["post_list"]])
+
+            # saving a post invalidates cached pages once it commits
+            with self.captureOnCommitCallbacks(execute=True):
+                Post.objects.get(id=post1.id).save()
+
+            response = self.client.get(list_url)
+            self.assertEqual(["A Renamed Post", "Test Post"], [p.title for p in response.context["post_list"]])
+
+            # as does deleting one
+            with self.captureOnCommitCallbacks(execute=True):
+                post1.delete()
+
+            response = self.client.get(list_url)
+            self.assertEqual(list(response.context["post_list"]), [self.post])
+
+            # and users with different permissions get different pages
+            view = response.context["view"]
+            author_key = view.derive_list_cache_key()
+
+            self.client.login(username="superuser", password="superuser")
+            response = self.client.get(list_url)
+            self.assertNotEqual(author_key, response.context["view"].derive_list_cache_key())
+
+        # lists are only cached if they ask to be
+        Post.objects.filter(id=self.post.id).update(title="Untitled")
+        response = self.client.get(list_url)
+        self.assertEqual(["Untitled"], [p.title for p in response.context["post_list"]])
+
+        # saves in one transaction only bump the version of their model once, and only if it has cached lists
+        with patch("smartmin.caching.cache.set_many") as mock_set_many:
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(3):
+                    Post.objects.create(
+                        title="Post %d" % i,
+                        body="Body",
+                        order=i,
+                        tags="",
+                        created_by=self.author,
+                        modified_by=self.author,
+                    )
+                Category.objects.create(name="fruit", created_by=self.author, modified_by=self.author)
+
+            self.assertEqual(1, mock_set_many.call_count)
+            self.assertEqual([list_version_key(Post)], list(mock_set_many.call_args[0][0]))
+
+            # bumps rolled back with a savepoint are still made by later saves in the transaction
+            mock_set_many.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(ValueError), transaction.atomic():
+                    self.post.save()
+                    raise ValueError("rolled back")
+                self.post.save()
+
+            self.assertEqual(1, mock_set_many.call_count)
+
+        # changes on other databases wait for the transactions of those databases
+        with patch("smartmin.caching.transaction") as mock_transaction:
+            mock_transaction.get_connection.return_value.in_atomic_block = True
+            bump_list_version(Post, using="other")
+
+        mock_transaction.get_connection.assert_called_once_with("other")
+        self.assertEqual("other", mock_transaction.on_commit.call_args[1]["using"])
+        mock_transaction.on_commit.call_args[0][0]()
+
+        # models are registered when the URLs of their cached lists are loaded
+        cached_list_models.discard(Post)
+        PostCRUDL.List.as_view()
+        self.assertNotIn(Post, cached_list_models)
+        PostCRUDL.List.as_view(list_cache_timeout=60)
+        self.assertIn(Post, cached_list_models)
+
+    def test_list_keyset(self):
+        def create_post(title):
+            return Post.objects.create(
+                title=title, body="Body", order=1, tags="post", created_by=self.author, modified_by=self.author
+            )
+
+        post1 = create_post("A Post")
+        post2 = create_post("B Post")
+        post3 = create_post("B Post")
+        post4 = create_post("C Post")
+
+        self.client.login(username="author", password="author")
+        list_url = reverse("blog.post_list")
+
+        with patch.object(PostCRUDL.List, "paginate_keyset", True), patch.object(PostCRUDL.List, "paginate_by", 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(list_url)
+
+            # no count is needed
+            self.assertFalse([q for q in queries.captured_queries if "COUNT" in q["sql"]])
+
+            page = response.context["page_obj"]
+            self.assertEqual(list(response.context["post_list"]), [post1, post2])
+            self.assertTrue(page.has_next())
+            self.assertFalse(page.has_previous())
+            self.assertContains(response, "page_after=%s" % page.next_cursor)
+
+            # posts with the same title are paged by their primary key
+            response = self.client.get(list_url + "?page_after=%s" % page.next_cursor)
+            page = response.context["page_obj"]
+            self.assertEqual(list(response.context["post_list"]), [post3, post4])
+            self.assertTrue(page.has_next())
+            self.assertTrue(page.has_previous())
+
+            response = self.client.get(list_url + "?page_after=%s" % page.next_cursor)
+            page = response.context["page_obj"]
+            self.assertEqual(list(response.context["post_list"]), [self.post])
+            self.assertFalse(page.has_next())
+            self.assertNotContains(response, "page_after=")
+
+            # and we can go back again
+            response = self.client.get(list_url + "?page_before=%s" % page.previous_cursor)
+            page = response.context["page_obj"]
+            self.assertEqual(list(response.context["post_list"]), [post3, post4])
+            self.assertContains(response, "page_before=%s" % page.previous_cursor)
+
+            response = self.client.get(list_url + "?page_before=%s" % page.previous_cursor)
+            self.assertEqual(list(response.context["post_list"]), [post1, post2])
+            self.assertFalse(response.context["page_obj"].has_previous())
+
+            # cursors follow the ordering of the list
+            response = self.client.get(list_url + "?_order=-title")
+            self.assertEqual(list(response.context["post_list"]), [self.post, post4])
+            response = self.client.get(
+                list_url + "?_order=-title&page_after=%s" % response.context["page_obj"].next_cursor
+            )
+            self.assertEqual(list(response.context["post_list"]), [post3, post2])
+
+            # select2 responses include the cursor of their next page
+            next_cursor = self.client.get(list_url).context["page_obj"].next_cursor
+            response = self.client.get(list_url + "?_format=select2")
+            self.assertEqual(
+                response.json(),
+                {
+                    "results": [{"id": post1.id, "text": "A Post"}, {"id": post2.id, "text": "B Post"}],
+                    "err": "nil",
+                    "more": True,
+                    "page_after": next_cursor,
+                },
+            )
+
+            # invalid cursors are treated like invalid page numbers
+            self.assertEqual(self.client.get(list_url + "?page_after=xyz").status_code, 404)
+            self.assertEqual(self.client.get(list_url + "?page_after=WzFd").status_code, 404)
+
+    def test_list_count_strategies(self):
+        for i in range(4):
+            Post.objects.create(
+                title="Post %d" % i, body="Body", order=i, tags="post", created_by=self.author, modified_by=self.author
+            )
+
+        self.client.login(username="author", password="author")
+        list_url = reverse("blog.post_list")
+
+        # by default lists are counted exactly
+        with patch.object(PostCRUDL.List, "paginate_by", 2):
+            response = self.client.get(list_url)
+            self.assertIsInstance(response.context["paginator"].count_strategy, ExactCount)
+            self.assertEqual(response.context["paginator"].count, 5)
+            self.assertContains(response, "Results 1-2 of 5")
+
+        with (
+            patch.object(PostCRUDL.List, "paginate_by", 2),
+            patch.object(PostCRUDL.List, "count_strategy", "capped"),
+            patch.object(PostCRUDL.List, "count_cap", 3),
+        ):
+            response = self.client.get(list_url)
+            paginator = response.context["paginator"]
+            self.assertEqual((paginator.count, paginator.count_exact), (3, False))
+            self.assertContains(response, "Results 1-2 of 3+")
+
+            # pages past our capped count can still be read
+            response = self.client.get(list_url + "?page=3")
+            self.assertEqual(["Test Post"], [p.title for p in response.context["post_list"]])
+            self.assertFalse(response.context["page_obj"].has_next())
+            self.assertTrue(response.context["page_obj"].has_previous())
+            self.assertContains(response, "Results 5-5 of 3+")
+
+            self.assertEqual(self.client.get(list_url + "?page=4").status_code, 404)
+            self.assertEqual(self.client.get(list_url + "?page=0").status_code, 404)
+
+            # lists under the cap are counted exactly
+            response = self.client.get(list_url + "?search=test")
+            self.assertEqual(
+                (response.context["paginator"].count, response.context["paginator"].count_exact), (1, True)
+            )
+
+        # auto caps counts when searching and estimates them otherwise
+        with patch.object(PostCRUDL.List, "count_strategy", "auto"):
+            response = self.client.get(list_url)
+            self.assertIsInstance(response.context["paginator"].count_strategy, EstimatedCount)
+
+            # which for databases without estimates like SQLite, means exact counts
+            self.assertEqual(
+                (response.context["paginator"].count, response.context["paginator"].count_exact), (5, True)
+            )
+
+            response = self.client.get(list_url + "?search=post")
+            self.assertIsInstance(response.context["paginator"].count_strategy, CappedCount)
+
+        # on Postgres, whole tables are estimated from their statistics and filtered querysets by their plans
+        class FakeCursor:
+            def __init__(self, row):
+                self.row = row
+                self.executed = []
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def execute(self, sql, params):
+                self.executed.append(sql)
+
+            def fetchone(self):
+                return self.row
+
+        cursor = FakeCursor((250000.0,))
+        fake_connections = {"default": SimpleNamespace(vendor="postgresql", cursor=lambda: cursor)}
+        with patch("smartmin.pagination.connections", fake_connections):
+            self.assertEqual(EstimatedCount().count(Post.objects.all()), (250000, False))
+            self.assertIn("pg_class", cursor.executed[0])
+
+            cursor.row = ('[{"Plan": {"Plan Rows": 54321}}]',)
+            self.assertEqual(EstimatedCount().count(Post.objects.filter(order__gt=1)), (54321, False))
+            self.assertTrue(cursor.executed[1].startswith("EXPLAIN (FORMAT JSON) SELECT"))
+
+            # small estimates are replaced by exact counts
+            cursor.row = ([{"Plan": {"Plan Rows": 30}}],)
+            self.assertEqual(EstimatedCount().count(Post.objects.filter(order__gt=1)), (2, True))
+
+        self.assertEqual(CappedCount(1000).label(1000, False), "1000+")
+        self.assertEqual(EstimatedCount().label(123456, False), "~123456")
+        self.assertEqual(EstimatedCount().label(12, True), "12")
+
+    def test_list_search_backends(self):
+        post1 = Post.objects.create(
+            title="Apple Pie", body="With cream", order=1, tags="food", created_by=self.author, modified_by=self.author
+        )
+        post2 = Post.objects.create(
+            title="Pear Tart", body="Apple free", order=2, tags="food", created_by=self.author, modified_by=self.author
+        )
+
+        self.client.login(username="author", password="author")
+        list_url = reverse("blog.post_list")
+
+        response = self.client.get(list_url + "?search=apple")
+        self.assertIsInstance(response.context["view"].derive_search_backend(), LikeSearch)
+        self.assertEqual(list(response.context["post_list"]), [post1, post2])
+
+        # trigram searches always use icontains, which Postgres can use trigram indexes for
+        self.assertEqual(
+            TrigramSearch().derive_lookups(("title__iexact", "body", "created_by__username__icontains")),
+            ["title__icontains", "body__icontains", "created_by__username__icontains"],
+        )
+        with patch.object(PostCRUDL.List, "search_backend", "trigram"):
+            response = self.client.get(list_url + "?search=apple%20cream")
+            self.assertEqual(list(response.context["post_list"]), [post1])
+
+        # full-text searches fall back to LIKE searches on databases other than Postgres
+        with patch.object(PostCRUDL.List, "search_backend", "fulltext"):
+            response = self.client.get(list_url + "?search=tart")
+            self.assertIsInstance(response.context["view"].derive_search_backend(), FullTextSearch)
+            self.assertEqual(list(response.context["post_list"]), [post2])
+
+        # but on Postgres match a search vector of the fields
+        with patch("smartmin.search.connections", {"default": SimpleNamespace(vendor="postgresql")}):
+            queryset = FullTextSearch().search(Post.objects.all(), ("title__icontains", "body"), "apple -cream")
+
+        columns = [
+            e.target.name for e in queryset.query.annotations["_search_vector"].flatten() if hasattr(e, "target")
+        ]
+        self.assertEqual(columns, ["title", "body"])
+        query = queryset.query.where.children[0].rhs
+        self.assertEqual(query.function, "websearch_to_tsquery")
+        self.assertEqual(query.source_expressions[1].value, "apple -cream")
+
+        self.assertEqual(search_field_path("created_by__username__iexact"), "created_by__username")
+        self.assertEqual(search_field_path("title"), "title")
+
+        # and we can get the indexes each backend needs
+        self.assertEqual(search_indexes(("title__icontains",), "post_search", backend="like"), [])
+
+        indexes = search_indexes(("title__icontains", "body__icontains"), "post_trgm", backend="trigram")
+        self.assertEqual([i.name for i in indexes], ["post_trgm_0", "post_trgm_1"])
+        self.assertEqual(indexes[0].expressions[0].extra["name"], "gin_trgm_ops")
+
+        indexes = search_indexes(("title__icontains", "body__icontains"), "post_search")
+        self.assertEqual([i.name for i in indexes], ["post_search"])
+        self.assertEqual(indexes[0].expressions[0], FullTextSearch().vector(("title", "body")))
+
+    def test_list_auto_related(self):
+        for i in range(3):
+            Post.objects.create(
+                title="Post %d" % i,
+                body="Body",
+                order=i,
+                tags="post",
+                created_by=self.author,
+                modified_by=self.superuser,
+            )
+
+        self.client.login(username="author", password="author")
+        list_url = reverse("blog.post_list")
+
+        # by default each post's author is fetched as it's displayed
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(list_url)
+        num_queries = len(queries)
+
+        with patch.object(PostCRUDL.List, "auto_related", True), patch.object(PostCRUDL.List, "auto_only", True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(list_url)
+
+            self.assertEqual(len(queries), num_queries - 4)
+            self.assertContains(response, "Post 2")
+            self.assertContains(response, "author")
+
+            # and only the columns we display are loaded
+            post_query = next(
+                q["sql"] for q in queries.captured_queries if "blog_post" in q["sql"] and "LIMIT" in q["sql"]
+            )
+            self.assertIn('"blog_post"."title"', post_query)
+            self.assertNotIn('"blog_post"."body"', post_query)
+
+        class PostList(SmartListView):
+            model = Post
+            fields = ("title", "is_active", "created_by.username", "created_by.groups", "modified_by", "tags")
+            select_related = ("modified_by",)
+            auto_related = True
+            auto_only = True
+
+            def get_tags(self, obj):
+                return obj.tags.upper()
+
+        view = PostList()
+        self.assertEqual(
+            view.derive_field_relations(),
+            (
+                ["created_by", "modified_by"],
+                ["created_by__groups"],
+                ["id", "is_active", "title", "created_by__username", "tags", "created_by", "modified_by"],
+            ),
+        )
+        # our fields are only walked once per request however many times what they need is asked for
+        with patch.object(PostList, "derive_field_relations", wraps=view.derive_field_relations) as mock_derive:
+            self.assertEqual(view.derive_select_related(), ["modified_by", "created_by"])
+            self.assertEqual(view.derive_prefetch_related(), ["created_by__groups"])
+            self.assertEqual(len(view.derive_only()), 7)
+            self.assertEqual(1, mock_derive.call_count)
+
+        queryset = Post.objects.select_related(*view.derive_select_related()).only(*view.derive_only())
+        post = queryset.prefetch_related(*view.derive_prefetch_related()).get(title="Post 1")
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [view.lookup_field_value({}, post, f) for f in ("title", "created_by.username", "modified_by", "tags")],
+                ["Post 1", "author", self.superuser, "POST"],
+            )
+
+        # related objects used by their properties or as a whole are loaded in full
+        PostList.fields = ("title", "created_by.get_full_name", "created_by.username")
+        self.assertEqual(
+            view.derive_field_relations(), (["created_by"], [], ["id", "is_active", "title", "created_by"])
+        )
+
+        # but we can't know what columns properties of our model need
+        PostList.fields = ("title", "pk")
+        view = PostList()
+        self.assertEqual(view.derive_field_relations(), ([], [], None))
+        self.assertIsNone(view.derive_only())
+
+    def test_view_profiling(self):
+        view_stats.reset()
+        self.client.login(username="author", password="author")
+        list_url = reverse("blog.post_list")
+
+        # views aren't profiled by default
+        response = self.client.get(list_url)
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(view_stats.as_json(), [])
+
+        with override_settings(SMARTMIN_VIEW_PROFILING=True):
+            with self.assertLogs("smartmin.profiling", level="INFO") as logs:
+                response = self.client.get(list_url)
+
+            timings = [t.split(";")[0] for t in response["Server-Timing"].split(", ")]
+            self.assertEqual(
+                timings, ["total", "dispatch", "permission", "pre_process", "context", "render", "template"]
+            )
+            self.assertRegex(response["Server-Timing"], r'^total;dur=\d+\.\d;desc="\d+ queries"')
+
+            record = logs.records[0]
+            self.assertEqual(record.view, "test_runner.blog.views.PostCRUDL.List")
+            self.assertEqual(record.url_name, "blog.post_list")
+            self.assertEqual(record.status, 200)
+            self.assertGreater(record.phases["context"]["queries"], 0)
+            self.assertEqual(
+                record.phases["total"]["queries"],
+                record.phases["dispatch"]["queries"] + record.phases["template"]["queries"],
+            )
+
+            # responses which aren't rendered from templates are profiled too
+            self.client.logout()
+            response = self.client.get(list_url)
+            self.assertEqual(response.status_code, 302)
+            self.assertIn("permission;dur=", response["Server-Timing"])
+
+            # and views can opt out
+            with patch.object(PostCRUDL.Read, "profiling", False):
+                response = self.client.get(reverse("blog.post_read", args=[self.post.id]))
+                self.assertNotIn("Server-Timing", response)
+
+        stats = view_stats.as_json()
+        self.assertEqual([(s["url_name"], s["requests"]) for s in stats], [("blog.post_list", 2)])
+        self.assertEqual(stats[0]["phases"]["template"]["max_queries"], record.phases["template"]["queries"])
+        self.assertEqual(
+            set(stats[0]["phases"]), {"total", "dispatch", "permission", "pre_process", "context", "render", "template"}
+        )
+
+        view_stats.reset()
+        self.assertEqual(view_stats.as_json(), [])
+
     def test_csv_export(self):
         Post.objects.create(
             title="Café Poste",
@@ -453,6 +957,261 @@ class PostTest(SmartminTest):
         self.assertEqual('"Café Poste","café"', rows[1])
         self.assertEqual('"Test Post","testing_tag"', rows[2])
 
+    def test_field_accessors(self):
+        class PostList(SmartListView):
+            model = Post
+            fields = ("title", "tags", "created_by.username", "created_by.get_username", "unknown")
+
+            def get_tags(self, obj):
+                return obj.tags.upper()
+
+        view = PostList()
+        fields = view.fields
+        accessors = view.derive_field_accessors(fields)
+
+        # view methods are used as they are, and accessors are only worked out once
+        self.assertEqual(accessors[1], view.get_tags)
+        self.assertEqual(accessors, view.derive_field_accessors(fields))
+        self.assertIs(accessors[2], view.get_field_accessor("created_by.username"))
+
+        values = [accessor(self.post) for accessor in accessors]
+        self.assertEqual(values, [view.lookup_field_value({}, self.post, field) for field in fields])
+        self.assertEqual(values, ["Test Post", "TESTING_TAG", "author", "author", None])
+
+        # views which customize looking up values still have that called for every value
+        class UpperPostList(PostList):
+            def lookup_field_value(self, context, obj, field):
+                return str(super().lookup_field_value(context, obj, field)).upper()
+
+        view = UpperPostList()
+        values = [accessor(self.post) for accessor in view.derive_field_accessors(fields)]
+        self.assertEqual(values, ["TEST POST", "TESTING_TAG", "AUTHOR", "AUTHOR", "NONE"])
+
+    def test_field_metadata(self):
+        view = PostCRUDL().view_for_action("list")()
+        metadata = get_field_metadata(Post)
+        self.assertIs(metadata, get_field_metadata(Post))
+
+        # once built, metadata is looked up without going back to the fields of our model
+        with patch.object(Post._meta, "get_fields", side_effect=AssertionError("metadata rebuilt")):
+            self.assertEqual("Title", view.lookup_field_label({}, "title"))
+            self.assertEqual("Created By", view.lookup_field_label({}, "created_by.created_by"))
+            self.assertEqual("Body", view.lookup_field_label({}, "body", default="Body"))
+            self.assertEqual(
+                "Whether this item is active, use this instead of deleting", view.lookup_field_help("is_active")
+            )
+            self.assertTrue(view.lookup_field_orderable("created_by"))
+            self.assertTrue(view.lookup_field_orderable("created_by_id"))
+            self.assertEqual("Created By Id", view.lookup_field_label({}, "created_by_id"))
+            self.assertIsNone(view.lookup_field_help("created_by_id"))
+            self.assertFalse(view.lookup_field_orderable("get_tags"))
+
+        # m2ms and reverse relations can't be ordered by
+        self.assertFalse(get_field_metadata(User)["groups"].orderable)
+        self.assertFalse(get_field_metadata(User)["blog_post_creations"].orderable)
+
+    def test_csv_export_streaming(self):
+        for i in range(4):
+            Post.objects.create(
+                title="Post %d" % i,
+                body="Body",
+                order=i,
+                tags="tag%d" % i,
+                created_by=self.author,
+                modified_by=self.author,
+            )
+
+        self.client.login(username="superuser", password="superuser")
+        expected = self.client.get(reverse("blog.post_csv")).content.decode("utf-8")
+
+        with patch.object(PostCRUDL.Csv, "streaming", True), patch.object(PostCRUDL.Csv, "export_chunk_size", 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("blog.post_csv"))
+                self.assertTrue(response.streaming)
+                self.assertEqual("text/csv; charset=utf-8", response["Content-Type"])
+                self.assertEqual("attachment; filename=post.csv", response["Content-Disposition"])
+
+                # our header goes out first, then rows a chunk at a time
+                chunks = [chunk.decode("utf-8") for chunk in response.streaming_content]
+
+            self.assertEqual(chunks[0], '"Title","Tags"\r\n')
+            self.assertEqual(len(chunks), 4)
+            self.assertEqual("".join(chunks), expected)
+
+            # no count or page of posts is needed
+            post_queries = [q["sql"] for q in queries.captured_queries if "blog_post" in q["sql"]]
+            self.assertEqual(len(post_queries), 1)
+            self.assertNotIn("COUNT", post_queries[0])
+
+    def test_export_async(self):
+        Post.objects.create(
+            title="Another Post", body="Body", order=2, tags="tag", created_by=self.author, modified_by=self.author
+        )
+
+        self.client.login(username="superuser", password="superuser")
+        expected = self.client.get(reverse("blog.post_csv") + "?_order=-title").content
+        self.assertTrue(expected.decode("utf-8").splitlines()[1].startswith('"Test Post"'))
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            # with no threads, exports are run as they are queued
+            with (
+                patch.dict("smartmin.jobs.import_runners", {"local": LocalImportRunner(max_workers=0)}),
+                patch.object(PostCRUDL.Csv, "export_async", True),
+            ):
+                response = self.client.get(reverse("blog.post_csv") + "?_order=-title")
+                export_id = response.url.split("export=")[1]
+                self.assertEqual(reverse("blog.post_csv") + "?export=" + export_id, response.url)
+
+            export_url = reverse("blog.post_csv") + "?export=" + export_id
+            download_url = export_url + "&_download=1"
+
+            response = self.client.get(export_url + "&_format=json")
+            self.assertEqual(dict(id=export_id, status="complete", error=None, url=download_url), response.json())
+
+            response = self.client.get(export_url)
+            self.assertContains(response, download_url.replace("&", "&amp;"))
+            self.assertEqual(0, response.context["refresh"])
+
+            # the export was made with the query of the request which queued it
+            response = self.client.get(download_url)
+            self.assertEqual('attachment; filename="post.csv"', response["Content-Disposition"])
+            self.assertEqual(expected, b"".join(response.streaming_content))
+
+            # exports which are still running are refreshed until they are done
+            request = RequestFactory().get(reverse("blog.post_xls"))
+            request.user = self.superuser
+            job = ExportJob.create(request)
+            response = self.client.get(reverse("blog.post_xls") + "?export=" + job.export_id)
+            self.assertEqual(2000, response.context["refresh"])
+            self.assertEqual(
+                404, self.client.get(reverse("blog.post_xls") + "?export=%s&_download=1" % job.export_id).status_code
+            )
+
+            job.execute()
+            self.assertEqual("complete", get_export_state(job.export_id)["status"])
+            response = self.client.get(reverse("blog.post_xls") + "?export=%s&_download=1" % job.export_id)
+            workbook = open_workbook(file_contents=b"".join(response.streaming_content))
+            self.assertEqual(["Title", "Tags"], workbook.sheet_by_index(0).row_values(0))
+
+            # exports are queued with the path of their view without any script prefix, and are prepared by
+            # pre_process just as the request which queued them was
+            def pre_process(view, request, *args, **kwargs):
+                view.filename = "prefixed.csv"
+
+            with (
+                patch.dict("smartmin.jobs.import_runners", {"local": LocalImportRunner(max_workers=0)}),
+                patch.object(PostCRUDL.Csv, "export_async", True),
+                patch.object(PostCRUDL.Csv, "pre_process", pre_process),
+            ):
+                response = self.client.get(reverse("blog.post_csv"), SCRIPT_NAME="/app")
+                self.assertTrue(response.url.startswith("/app" + reverse("blog.post_csv") + "?export="))
+
+                state = get_export_state(response.url.split("export=")[1])
+                self.assertEqual("complete", state["status"])
+                self.assertEqual("prefixed.csv", state["filename"])
+
+            # views whose pre_process returns a response can't be exported in the background
+            with patch.object(PostCRUDL.Csv, "pre_process", return_value=HttpResponse("redirected")):
+                request = RequestFactory().get(reverse("blog.post_csv"))
+                request.user = self.superuser
+                job = ExportJob.create(request)
+
+                with self.assertRaisesRegex(ImproperlyConfigured, "pre_process returned a response"):
+                    job.execute()
+
+                self.assertEqual("failed", get_export_state(job.export_id)["status"])
+
+            # exports can only be seen by whoever made them
+            self.client.login(username="author", password="author")
+            self.assertEqual(404, self.client.get(export_url).status_code)
+            self.assertEqual(404, self.client.get(download_url).status_code)
+            self.assertEqual(404, self.client.get(reverse("blog.post_csv") + "?export=unknown").status_code)
+
+            # files are deleted once they are older than exports are kept for
+            name = "exports/%s/post.csv" % export_id
+            self.assertEqual(0, delete_expired_exports())
+            self.assertTrue(default_storage.exists(name))
+
+            expired = time.time() - 25 * 60 * 60
+            os.utime(default_storage.path(name), (expired, expired))
+
+            out = io.StringIO()
+            call_command("delete_expired_exports", stdout=out)
+            self.assertEqual("Deleted 1 expired export files\n", out.getvalue())
+            self.assertFalse(default_storage.exists(name))
+
+        # there's nothing to delete if no exports have been made
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            self.assertEqual(0, delete_expired_exports())
+
+    def test_xls_export(self):
+        for i in range(4):
+            Post.objects.create(
+                title="Post %d" % i,
+                body="Body",
+                order=i,
+                tags="tag%d" % i,
+                created_by=self.author,
+                modified_by=self.author,
+            )
+
+        self.client.login(username="superuser", password="superuser")
+        expected = (
+            [["Title", "Tags"]] + [["Post %d" % i, "tag%d" % i] for i in range(4)] + [["Test Post", "testing_tag"]]
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("blog.post_xls"))
+            content = b"".join(response.streaming_content)
+
+        self.assertEqual("application/vnd.ms-excel", response["Content-Type"])
+        self.assertEqual("attachment; filename=post.xls", response["Content-Disposition"])
+
+        # our posts are read once, without any count or page of them
+        post_queries = [q["sql"] for q in queries.captured_queries if "blog_post" in q["sql"]]
+        self.assertEqual(len(post_queries), 1)
+        self.assertNotIn("COUNT", post_queries[0])
+
+        workbook = open_workbook(file_contents=content)
+        self.assertEqual(workbook.sheet_names(), ["Posts"])
+        sheet = workbook.sheet_by_index(0)
+        self.assertEqual([sheet.row_values(r) for r in range(sheet.nrows)], expected)
+
+        # full sheets continue on new ones, each with our header
+        with patch.object(XlsWriter, "max_rows", 3):
+            response = self.client.get(reverse("blog.post_xls"))
+            workbook = open_workbook(file_contents=b"".join(response.streaming_content))
+
+        self.assertEqual(workbook.sheet_names(), ["Posts", "Posts (2)", "Posts (3)"])
+        sheets = [[s.row_values(r) for r in range(s.nrows)] for s in workbook.sheets()]
+        self.assertEqual(sheets, [expected[:3], expected[:1] + expected[3:5], expected[:1] + expected[5:]])
+
+        # and we can export .xlsx workbooks
+        from openpyxl import load_workbook
+
+        with patch.object(PostCRUDL.Xls, "export_format", "xlsx"), patch.object(XlsxWriter, "max_rows", 4):
+            response = self.client.get(reverse("blog.post_xls"))
+            content = b"".join(response.streaming_content)
+
+        self.assertEqual(XlsxWriter.content_type, response["Content-Type"])
+        self.assertEqual("attachment; filename=post.xlsx", response["Content-Disposition"])
+
+        workbook = load_workbook(io.BytesIO(content), read_only=True)
+        self.assertEqual(workbook.sheetnames, ["Posts", "Posts (2)"])
+        sheets = [[list(row) for row in sheet.iter_rows(values_only=True)] for sheet in workbook.worksheets]
+        self.assertEqual(sheets, [expected[:4], expected[:1] + expected[4:]])
+
+        # empty exports still have a sheet with our header
+        Post.objects.all().delete()
+        response = self.client.get(reverse("blog.post_xls"))
+        sheet = open_workbook(file_contents=b"".join(response.streaming_content)).sheet_by_index(0)
+        self.assertEqual([sheet.row_values(r) for r in range(sheet.nrows)], expected[:1])
+
+        # sheet names are cleaned up and kept short enough with their numbers
+        writer = XlsWriter("Posts: [Drafts] by date/author and more", ["Title"])
+        self.assertEqual(writer.sheet_name(1), "Posts   Drafts  by date author")
+        self.assertEqual(writer.sheet_name(12), "Posts   Drafts  by date au (12)")
+
     def test_success_url(self):
         self.client.login(username="author", password="author")
 
@@ -735,6 +1494,721 @@ class PostTest(SmartminTest):
         with open("test_runner/blog/test_files/bom_import.csv", "rb") as open_file:
             self.assertEqual(Post.get_import_file_headers(open_file), ["urn:tel", "name", "field:email-address"])
 
+    def test_parse_import_source(self):
+        upload = SimpleUploadedFile("posts.csv", b"# exported posts\ntitle,order\nOne,1\nTwo,2\n")
+        task = SimpleNamespace(csv_file=upload, created_by=self.author, import_params=None, import_results=None)
+
+        with ImportSource.from_upload(upload) as source:
+            self.assertFalse(source.parsed)
+            self.assertEqual(["title", "order"], Post.get_import_file_headers(source))
+            self.assertTrue(source.parsed)
+            self.assertEqual("csv", source.format)
+            self.assertEqual(2, source.header_line)
+            self.assertEqual(b"One,1", source.view[source.data_offset : source.data_offset + 5])
+
+            # importing a parsed source starts straight from its data
+            with patch.object(Post, "parse_import_csv_source", wraps=Post.parse_import_csv_source) as mock_parse:
+                with patch.object(Post, "prepare_fields", side_effect=lambda field_dict, *args: field_dict):
+                    records = Post.import_csv(task, source=source)
+
+                self.assertEqual(0, mock_parse.call_count)
+
+            self.assertEqual(["One", "Two"], [p.title for p in records])
+            self.assertEqual({"records": 2, "errors": 0, "error_messages": []}, json.loads(task.import_results))
+
+            # the source is left for us to close
+            self.assertTrue(os.path.exists(source.path))
+
+        for path, fmt in (
+            ("test_runner/blog/test_files/posts.xls", "xls"),
+            ("test_runner/blog/test_files/posts.xlsx", "xlsx"),
+        ):
+            Post.objects.filter(title__startswith="My ").delete()
+            task = self.create_import_task(path)
+
+            with ImportSource(path) as source:
+                self.assertEqual(["title", "body", "order", "tags"], Post.get_import_file_headers(source))
+                self.assertEqual(fmt, source.format)
+
+                # the reader used to read the header is also used to read the rows
+                reader = source.reader
+                records = Post.import_csv(task, source=source)
+
+                self.assertIsNone(source.reader)
+                self.assertEqual(4, len(records))
+
+                # after which it's read with a new reader
+                records = Post.import_spreadsheet(type(reader), source, self.author, None)
+                self.assertEqual(4, len(records))
+
+    def create_import_task(self, path, import_params=None):
+        csv_file = File(open(path, "rb"))
+        self.addCleanup(csv_file.close)
+        return SimpleNamespace(
+            csv_file=csv_file, created_by=self.author, import_params=import_params, import_results=None
+        )
+
+    def test_import_csv(self):
+        titles = ["My first post", "My 2nd post", "My 3rd post", "My 4th post"]
+
+        for path in (
+            "test_runner/blog/test_files/posts.csv",
+            "test_runner/blog/test_files/posts.xls",
+            "test_runner/blog/test_files/posts.xlsx",
+        ):
+            Post.objects.filter(title__in=titles).delete()
+
+            task = self.create_import_task(path)
+            records = Post.import_csv(task)
+
+            self.assertEqual(titles, [p.title for p in records])
+            self.assertEqual({"records": 4, "errors": 0, "error_messages": []}, json.loads(task.import_results))
+            self.assertEqual(self.author, records[0].created_by)
+            self.assertEqual(0, records[0].order)
+
+    def test_import_benchmark(self):
+        out = io.StringIO()
+        call_command("import_benchmark", rows=[5], batch_size=2, stdout=out)
+
+        output = out.getvalue().splitlines()
+        self.assertEqual(5, len(output))
+        self.assertEqual(["csv", "5"], output[2].split()[:2])
+        self.assertEqual(["xlsx", "5"], output[4].split()[:2])
+
+        # benchmarks clean up after themselves
+        self.assertFalse(Post.objects.filter(created_by__username="benchmark").exists())
+
+    def test_convert_xldates(self):
+        tz = ZoneInfo("Africa/Kigali")
+        xldates = [61, 45352.52100694, 45352.999999999, 1.5, 60.5, 0.25, -1, 3000000]
+
+        def expected(datemode):
+            dates = []
+            for xldate in xldates:
+                try:
+                    dates.append(datetime(*xldate_as_tuple(xldate, datemode), tzinfo=tz))
+                except (XLDateError, ValueError):
+                    dates.append(None)
+            return dates
+
+        # with and without NumPy, numbers are converted just like xlrd would convert them
+        for datemode in (0, 1):
+            self.assertEqual(expected(datemode), convert_xldates(xldates, datemode, tz))
+
+            with patch("smartmin.imports.numpy", None):
+                self.assertEqual(expected(datemode), convert_xldates(xldates, datemode, tz))
+
+        self.assertEqual(datetime(1900, 3, 1, tzinfo=tz), convert_xldates([61], 0, tz)[0])
+        self.assertEqual(datetime(2024, 3, 2, tzinfo=tz), convert_xldates([45352.999999999], 0, tz)[0])
+
+    def test_xls_column_values(self):
+        tz = ZoneInfo("Africa/Kigali")
+        date_style = xlwt.easyxf(num_format_str="YYYY-MM-DD HH:MM:SS")
+
+        workbook = xlwt.Workbook()
+        sheet = workbook.add_sheet("Posts")
+        for row, values in enumerate(
+            [
+                ("title", "written_on", "order"),
+                ("One", datetime(2024, 3, 1, 12, 30, 15), 1),
+                (' "Two" ', datetime(1900, 3, 1), 2.5),
+                ("Three", "", 3),
+            ]
+        ):
+            for col, value in enumerate(values):
+                sheet.write(row, col, value, date_style if isinstance(value, datetime) else xlwt.Style.default_style)
+
+        out = io.BytesIO()
+        workbook.save(out)
+
+        with ImportSource.from_upload(SimpleUploadedFile("posts.xls", out.getvalue())) as source:
+            reader = XlsReader(Post, source)
+
+            # cells are converted a column at a time for each chunk of rows
+            with patch.object(Post, "import_chunk_size", 2):
+                self.assertEqual(
+                    [
+                        (2, ["One", datetime(2024, 3, 1, 12, 30, 15, tzinfo=tz), "1.0"]),
+                        (3, ["Two", datetime(1900, 3, 1, tzinfo=tz), "2.5"]),
+                        (4, ["Three", "", "3.0"]),
+                    ],
+                    list(reader.rows(tz)),
+                )
+                self.assertEqual([(4, ["Three", "", "3.0"])], list(reader.rows(tz, first_row=3)))
+
+            # models which convert cells themselves still get them one at a time
+            with patch.object(Post, "get_cell_value", side_effect=lambda workbook, tz, cell: cell.ctype):
+                self.assertEqual([(2, [1, 3, 2]), (3, [1, 3, 2]), (4, [1, 0, 2])], list(reader.rows(tz)))
+
+        # dates which can't be converted in bulk are converted a cell at a time, raising the same errors
+        workbook = xlwt.Workbook()
+        sheet = workbook.add_sheet("Posts")
+        sheet.write(0, 0, "written_on")
+        sheet.write(1, 0, 30, date_style)
+
+        out = io.BytesIO()
+        workbook.save(out)
+
+        with ImportSource.from_upload(SimpleUploadedFile("posts.xls", out.getvalue())) as source:
+            with self.assertRaises(XLDateAmbiguous):
+                list(XlsReader(Post, source).rows(tz))
+
+    def test_import_xlsx(self):
+        with open("test_runner/blog/test_files/posts.xlsx", "rb") as open_file:
+            self.assertEqual(Post.get_import_file_headers(open_file), ["title", "body", "order", "tags"])
+
+        with ImportSource("test_runner/blog/test_files/posts.xlsx") as source:
+            self.assertEqual(XlsxReader, next(Post.get_import_readers(source)))
+
+        # without openpyxl, .xlsx files aren't accepted and are read by the next of our readers
+        with ImportSource("test_runner/blog/test_files/posts.xlsx") as source:
+            with patch("importlib.util.find_spec", return_value=None):
+                self.assertEqual([XlsReader], list(Post.get_import_readers(source)))
+
+        # zip archives which aren't workbooks are left for our other readers and then read as CSV
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.writestr("notes.txt", "title,body")
+
+        for content in (archive.getvalue(), archive.getvalue()[:30]):
+            with ImportSource.from_upload(SimpleUploadedFile("posts.xlsx", content)) as source:
+                self.assertEqual(XlsxReader, next(Post.get_import_readers(source)))
+                with self.assertRaises(UnreadableSpreadsheet):
+                    XlsxReader(Post, source)
+
+                with patch.object(Post, "parse_import_csv_source", return_value=source) as mock_parse_csv:
+                    self.assertEqual(source, Post.parse_import_source(source))
+                    mock_parse_csv.assert_called_once_with(source)
+
+        # date cells get the same timezone handling as .xls date cells
+        tz = Post.get_import_timezone({"timezone": "Africa/Kigali"})
+        self.assertEqual(
+            datetime(2024, 3, 1, 12, 30, tzinfo=tz), Post.get_xlsx_cell_value(tz, datetime(2024, 3, 1, 12, 30))
+        )
+        self.assertEqual(datetime(2024, 3, 1, tzinfo=tz), Post.get_xlsx_cell_value(tz, date(2024, 3, 1)))
+        self.assertEqual("", Post.get_xlsx_cell_value(tz, None))
+        self.assertEqual("Hello", Post.get_xlsx_cell_value(tz, ' "Hello" '))
+        self.assertEqual("1.5", Post.get_xlsx_cell_value(tz, 1.5))
+
+        # imports can be resumed part way through a workbook
+        task = self.create_import_task("test_runner/blog/test_files/posts.xlsx")
+        task.import_results = json.dumps(
+            dict(records=2, errors=0, error_messages=[], checkpoint=dict(line=3, offset=None))
+        )
+        with patch.object(Post, "import_checkpoints", True):
+            records = Post.import_csv(task)
+
+        self.assertEqual(["My 3rd post", "My 4th post"], [p.title for p in records])
+        self.assertEqual(4, json.loads(task.import_results)["records"])
+
+    def test_import_source(self):
+        # files our storage keeps on local disk are used where they are
+        upload = SimpleNamespace(path=os.path.abspath("test_runner/blog/test_files/posts.csv"))
+        with ImportSource.from_upload(upload) as source:
+            self.assertEqual(upload.path, source.path)
+            self.assertFalse(source.temporary)
+            self.assertEqual(b"title,body,order,tags\n", source.view[:22])
+
+        self.assertTrue(os.path.exists(upload.path))
+
+        # anything else is streamed to a temporary file which is removed when we're done
+        upload = SimpleUploadedFile("posts.csv", b'\xef\xbb\xbftitle,body\r"My\rpost",Body\r\nLast,Body')
+        with ImportSource.from_upload(upload) as source:
+            self.assertTrue(source.temporary)
+            self.assertTrue(os.path.exists(source.path))
+
+            # lines are decoded with the same newline handling as a file opened in text mode
+            self.assertEqual(["title,body\n", '"My\n', 'post",Body\n', "Last,Body"], list(source.text_lines()))
+
+        self.assertFalse(os.path.exists(source.path))
+
+        with ImportSource.from_upload(SimpleUploadedFile("empty.csv", b"")) as source:
+            self.assertEqual(b"", source.view)
+            self.assertEqual([], list(source.text_lines()))
+
+    def test_detect_ascii_codec(self):
+        self.assertEqual("cp1252", detect_ascii_codec(b""))
+        self.assertEqual("cp1252", detect_ascii_codec(b"caf\xe9,cr\xe8me"))
+        self.assertEqual("mac_roman", detect_ascii_codec(b"caf\x8e,cr\x8fme"))
+
+        # scanning can be limited to a prefix of the data
+        self.assertEqual("cp1252", detect_ascii_codec(b"title,body\n\x9d", limit=11))
+        self.assertEqual("mac_roman", detect_ascii_codec(b"title,body\n\x9d", limit=12))
+
+        # sources only detect their codec once
+        upload = SimpleUploadedFile("posts.csv", b"title,body\nCr\x8fme,Body")
+        with ImportSource.from_upload(upload) as source:
+            with patch("smartmin.imports.detect_ascii_codec", wraps=detect_ascii_codec) as mock_detect:
+                self.assertEqual("mac_roman", source.ascii_codec)
+                self.assertEqual("mac_roman", source.ascii_codec)
+                self.assertEqual(1, mock_detect.call_count)
+
+        with override_settings(SMARTMIN_IMPORT_SNIFF_BYTES=10):
+            with ImportSource.from_upload(upload) as source:
+                self.assertEqual("cp1252", source.ascii_codec)
+
+    def test_import_column_plan(self):
+        plan = ImportColumnPlan(["title", "notes", "order"], converters={"order": int}, dropped=["notes"])
+        build = plan.compile({"created_by": "bob"})
+        self.assertEqual({"title": " A ", "order": 3, "created_by": "bob"}, build([" A ", "x", "3"]))
+
+        # plan constants take precedence over those it's compiled with
+        plan = ImportColumnPlan(["title", "notes"], dropped=["notes"], constants={"created_by": "jim"})
+        plan.normalize = Post.normalize_value
+        build = plan.compile({"created_by": "bob"})
+        self.assertEqual({"title": "A", "created_by": "jim"}, build([' "A" ', "x"]))
+
+        build = ImportColumnPlan(["notes"], dropped=["notes"]).compile()
+        self.assertEqual({}, build(["x"]))
+
+        def validate_import_header(header):
+            return ImportColumnPlan(
+                header, converters={"order": lambda v: int(float(v)) + 10}, dropped=["tags"], constants={"tags": "new"}
+            )
+
+        for path in ("test_runner/blog/test_files/posts.csv", "test_runner/blog/test_files/posts.xls"):
+            with (
+                patch.object(Post, "validate_import_header", side_effect=validate_import_header),
+                patch.object(Post, "prepare_fields", side_effect=lambda field_dict, import_params, user: field_dict),
+            ):
+                task = self.create_import_task(path)
+                records = Post.import_csv(task)
+
+            self.assertEqual([10, 10, 10, 10], [p.order for p in records])
+            self.assertEqual(["new", "new", "new", "new"], [p.tags for p in records])
+
+        # plans returned by models are copied rather than changed, and anything else they return is ignored
+        plan = ImportColumnPlan(["title", "body", "order", "tags"])
+        for returned in (plan, True, "ok"):
+            with patch.object(Post, "validate_import_header", return_value=returned):
+                task = self.create_import_task("test_runner/blog/test_files/posts.csv")
+                self.assertEqual(4, len(Post.import_csv(task)))
+
+                derived = Post.derive_import_plan(["title"], normalize=Post.normalize_value)
+                self.assertIsInstance(derived, ImportColumnPlan)
+                self.assertIsNot(derived, plan)
+                self.assertEqual(Post.normalize_value, derived.normalize)
+
+        self.assertIsNone(plan.normalize)
+
+    def test_import_csv_row_errors(self):
+        def prepare_fields(field_dict, import_params=None, user=None):
+            if field_dict["title"] == "My 3rd post":
+                raise SmartImportRowError("Not the third")
+            field_dict["order"] = int(float(field_dict["order"]))
+            return field_dict
+
+        for path in ("test_runner/blog/test_files/posts.csv", "test_runner/blog/test_files/posts.xls"):
+            with patch.object(Post, "prepare_fields", side_effect=prepare_fields):
+                task = self.create_import_task(path)
+                records = Post.import_csv(task)
+
+            self.assertEqual(3, len(records))
+            self.assertEqual(
+                {"records": 3, "errors": 1, "error_messages": [{"line": 4, "error": "Not the third"}]},
+                json.loads(task.import_results),
+            )
+
+    def test_import_csv_bulk(self):
+        with patch.object(Post, "bulk_import_batch_size", 3):
+            task = self.create_import_task("test_runner/blog/test_files/posts.csv")
+
+            # one INSERT per batch, each inside a savepoint
+            with self.assertNumQueries(6):
+                records = Post.import_csv(task)
+
+        self.assertEqual(["My first post", "My 2nd post", "My 3rd post", "My 4th post"], [p.title for p in records])
+        self.assertTrue(all(p.id for p in records))
+        self.assertEqual({"records": 4, "errors": 0, "error_messages": []}, json.loads(task.import_results))
+
+        # a batch which fails to be written is retried a row at a time to find the bad rows
+        def create_instances(field_dicts):
+            if any(f["title"] == "My 2nd post" for f in field_dicts):
+                raise IntegrityError("bad row in batch")
+            return Post.objects.bulk_create([Post(**f) for f in field_dicts])
+
+        def create_instance(field_dict):
+            if field_dict["title"] == "My 2nd post":
+                raise SmartImportRowError("Duplicate post")
+            return Post.objects.create(**field_dict)
+
+        def prepare_fields(field_dict, import_params=None, user=None):
+            if field_dict["title"] == "My 3rd post":
+                raise SmartImportRowError("Not the third")
+            field_dict["order"] = int(float(field_dict["order"]))
+            return field_dict
+
+        with (
+            patch.object(Post, "bulk_import_batch_size", 3),
+            patch.object(Post, "create_instances", side_effect=create_instances),
+            patch.object(Post, "create_instance", side_effect=create_instance),
+            patch.object(Post, "prepare_fields", side_effect=prepare_fields),
+        ):
+            task = self.create_import_task("test_runner/blog/test_files/posts.csv")
+            records = Post.import_csv(task)
+
+        self.assertEqual(["My first post", "My 4th post"], [p.title for p in records])
+        self.assertEqual(
+            {
+                "records": 2,
+                "errors": 2,
+                "error_messages": [{"line": 3, "error": "Duplicate post"}, {"line": 4, "error": "Not the third"}],
+            },
+            json.loads(task.import_results),
+        )
+
+    def test_import_csv_bulk_create_instance(self):
+        # a model which only overrides create_instance has it called for each row, even in bulk mode
+        def create_instance(field_dict):
+            if field_dict["title"] == "My 2nd post":
+                raise SmartImportRowError("Duplicate post")
+            return Post.objects.create(**field_dict)
+
+        with (
+            patch.object(Post, "bulk_import_batch_size", 3),
+            patch.object(Post, "create_instance", side_effect=create_instance) as mock_create_instance,
+        ):
+            task = self.create_import_task("test_runner/blog/test_files/posts.csv")
+            records = Post.import_csv(task)
+
+        self.assertEqual(4, mock_create_instance.call_count)
+        self.assertEqual(["My first post", "My 3rd post", "My 4th post"], [p.title for p in records])
+        self.assertFalse(Post.objects.filter(title="My 2nd post").exists())
+        self.assertEqual(
+            {"records": 3, "errors": 1, "error_messages": [{"line": 3, "error": "Duplicate post"}]},
+            json.loads(task.import_results),
+        )
+
+    def test_import_csv_parallel(self):
+        with patch.object(Post, "import_workers", 2), patch.object(Post, "import_chunk_size", 1):
+            task = self.create_import_task("test_runner/blog/test_files/posts.csv")
+            records = Post.import_csv(task)
+
+            self.assertEqual(["My first post", "My 2nd post", "My 3rd post", "My 4th post"], [p.title for p in records])
+            self.assertEqual(self.author, records[0].created_by)
+            self.assertEqual({"records": 4, "errors": 0, "error_messages": []}, json.loads(task.import_results))
+
+            # exceptions in workers are reported against the line they happened on
+            task.csv_file = SimpleUploadedFile("posts.csv", b"title,body,order,tags\nOne,Body,1,a\nTwo,Body,x,b\n")
+            log = io.StringIO()
+
+            with self.assertRaisesRegex(Exception, "Line 3: could not convert string to float: 'x'"):
+                Post.import_csv(task, log=log)
+
+            self.assertIn("ValueError", log.getvalue())
+            self.assertTrue(Post.objects.filter(title="One").exists())
+
+            # plans with lambda converters can't be sent to workers so their rows are prepared in this process
+            def validate_import_header(header):
+                return ImportColumnPlan(header, converters={"tags": lambda tags: tags.upper()})
+
+            self.assertFalse(validate_import_header(["tags"]).is_picklable())
+            self.assertTrue(ImportColumnPlan(["tags"], converters={"tags": str.upper}).is_picklable())
+
+            task = self.create_import_task("test_runner/blog/test_files/posts.csv")
+            with (
+                patch.object(Post, "validate_import_header", side_effect=validate_import_header),
+                patch("smartmin.models.prepare_import_chunks_parallel") as mock_parallel,
+                self.assertLogs("smartmin.models", level="WARNING") as logs,
+            ):
+                records = Post.import_csv(task)
+
+            self.assertFalse(mock_parallel.called)
+            self.assertIn("module level functions rather than lambdas", logs.output[0])
+            self.assertEqual(["TAG1 TAG2"] * 4, [p.tags for p in records])
+
+    def test_import_csv_checkpoints(self):
+        def prepare_fields(field_dict, import_params=None, user=None):
+            if field_dict["title"] == "My 4th post":
+                raise ValueError("Database went away")
+            field_dict["order"] = int(float(field_dict["order"]))
+            return field_dict
+
+        for path in ("test_runner/blog/test_files/posts.csv", "test_runner/blog/test_files/posts.xls"):
+            Post.objects.filter(title__startswith="My ").delete()
+
+            task = self.create_import_task(path)
+
+            with patch.object(Post, "import_checkpoints", True), patch.object(Post, "import_chunk_size", 2):
+                with patch.object(Post, "prepare_fields", side_effect=prepare_fields):
+                    with self.assertRaisesRegex(Exception, "Line 5: Database went away"):
+                        Post.import_csv(task)
+
+                # only the first chunk was committed, and that's where our checkpoint is
+                self.assertEqual(
+                    ["My 2nd post", "My first post"],
+                    list(
+                        Post.objects.filter(title__startswith="My ").order_by("title").values_list("title", flat=True)
+                    ),
+                )
+                results = json.loads(task.import_results)
+                self.assertEqual(2, results["records"])
+                self.assertEqual(3, results["checkpoint"]["line"])
+
+                if path.endswith(".csv"):
+                    with open(path, "rb") as csv_file:
+                        csv_file.seek(results["checkpoint"]["offset"])
+                        self.assertEqual(b'"My 3rd post"', csv_file.read(13))
+                else:
+                    self.assertIsNone(results["checkpoint"]["offset"])
+
+                # running the import again resumes after the checkpoint, returning the records of both runs
+                records = Post.import_csv(task)
+
+                self.assertEqual(
+                    ["My first post", "My 2nd post", "My 3rd post", "My 4th post"], [p.title for p in records]
+                )
+                self.assertEqual(4, Post.objects.filter(title__startswith="My ").count())
+
+                results = json.loads(task.import_results)
+                self.assertEqual(4, results["records"])
+                self.assertEqual(0, results["errors"])
+                self.assertEqual(5, results["checkpoint"]["line"])
+                self.assertEqual([[records[0].pk, records[3].pk]], results["checkpoint"]["pks"])
+                self.assertTrue(results["checkpoint"]["finished"])
+
+                # and once finished, running it again imports nothing more but still returns all its records
+                with patch.object(Post, "parse_import_source") as mock_parse:
+                    self.assertEqual(records, list(Post.import_csv(task)))
+                    self.assertFalse(mock_parse.called)
+
+                self.assertEqual(4, Post.objects.filter(title__startswith="My ").count())
+
+        # keys which aren't integers are kept as strings
+        checkpoint = ImportCheckpoint(pks=[[3, 4]])
+        checkpoint.add_pks([5, 7, "abc"])
+        self.assertEqual([[3, 5], [7, 7], "abc"], checkpoint.pks)
+        self.assertEqual([3, 4, 5, 7], list(ImportCheckpoint(pks=[[3, 5], [7, 7]]).get_records(Post).pks))
+
+    def test_import_csv_progress(self):
+        reports = []
+
+        def progress(import_progress):
+            reports.append((import_progress.rows, import_progress.errors, json.loads(task.import_results)))
+            self.assertGreaterEqual(import_progress.rows_per_second, 0)
+
+        def prepare_fields(field_dict, import_params=None, user=None):
+            if field_dict["title"] == "My 2nd post":
+                raise SmartImportRowError("Bad post")
+            field_dict["order"] = int(float(field_dict["order"]))
+            return field_dict
+
+        task = self.create_import_task("test_runner/blog/test_files/posts.csv")
+
+        with patch.object(Post, "import_chunk_size", 1), patch.object(Post, "import_progress_interval", 2):
+            with patch.object(Post, "prepare_fields", side_effect=prepare_fields):
+                Post.import_csv(task, progress=progress)
+
+        # progress is reported every 2 rows, with the partial results saved on the task each time
+        self.assertEqual([2, 4], [rows for rows, errors, results in reports])
+        self.assertEqual([1, 1], [errors for rows, errors, results in reports])
+        self.assertEqual(1, reports[0][2]["records"])
+        self.assertEqual([{"line": 3, "error": "Bad post"}], reports[0][2]["error_messages"])
+        self.assertEqual({"rows", "errors", "elapsed", "rows_per_second"}, set(reports[0][2]["progress"]))
+        self.assertEqual(2, reports[0][2]["progress"]["rows"])
+
+        # once done, only the final results are left
+        self.assertEqual(
+            {"records": 3, "errors": 1, "error_messages": [{"line": 3, "error": "Bad post"}]},
+            json.loads(task.import_results),
+        )
+
+        # chunks of rows can take progress past several report points at once
+        reports = []
+        task = self.create_import_task("test_runner/blog/test_files/posts.xls")
+        with patch.object(Post, "import_chunk_size", 3), patch.object(Post, "import_progress_interval", 1):
+            Post.import_csv(task, progress=progress)
+
+        self.assertEqual([3, 4], [rows for rows, errors, results in reports])
+
+    def test_import_csv_lookups(self):
+        news = Category.objects.create(name="news", created_by=self.author, modified_by=self.author)
+        sport = Category.objects.create(name="sport", created_by=self.author, modified_by=self.author)
+
+        def get_import_lookups(import_params):
+            return {"category": ImportLookup(Category.objects.all(), "name")}
+
+        def prepare_fields(field_dict, import_params=None, user=None):
+            category = import_params["lookups"]["category"].get(field_dict.pop("category"))
+            if not category:
+                raise SmartImportRowError("Unknown category")
+
+            return dict(field_dict, body=category.name, order=category.id, tags="")
+
+        upload = SimpleUploadedFile(
+            "posts.csv", b'title,category\nOne,news\nTwo,"news"\nThree,sport\nFour,missing\nFive,missing\n'
+        )
+        task = SimpleNamespace(csv_file=upload, created_by=self.author, import_params=None, import_results=None)
+
+        with (
+            patch.object(Post, "import_chunk_size", 2),
+            patch.object(Post, "prepare_fields", side_effect=prepare_fields),
+        ):
+            with patch.object(Post, "get_import_lookups", side_effect=get_import_lookups):
+                with CaptureQueriesContext(connection) as queries:
+                    records = Post.import_csv(task)
+
+        self.assertEqual(["One", "Two", "Three"], [p.title for p in records])
+        self.assertEqual(["news", "news", "sport"], [p.body for p in records])
+        self.assertEqual([news.id, news.id, sport.id], [p.order for p in records])
+        self.assertEqual(
+            [{"line": 5, "error": "Unknown category"}, {"line": 6, "error": "Unknown category"}],
+            json.loads(task.import_results)["error_messages"],
+        )
+
+        # categories are fetched once for each of the first two chunks, the last chunk's missing one is remembered
+        category_queries = [q for q in queries.captured_queries if "blog_category" in q["sql"]]
+        self.assertEqual(2, len(category_queries))
+
+        # lookups can also be used on their own
+        lookup = ImportLookup(Category.objects.all(), "name")
+        lookup.add("new", news)
+        with self.assertNumQueries(2):
+            self.assertEqual(sport, lookup.get("sport"))
+            self.assertIsNone(lookup.get("other"))
+            self.assertIsNone(lookup.get("other"))
+            self.assertEqual(news, lookup.get("new"))
+
+        # keys are converted to the type of the field before being looked up and cached
+        lookup = ImportLookup(Category.objects.all(), "id")
+        with self.assertNumQueries(1):
+            lookup.prefetch(["%d" % sport.id, "x", ""])
+            self.assertEqual(sport, lookup.get("%d" % sport.id))
+            self.assertEqual(sport, lookup.get(sport.id))
+            self.assertIsNone(lookup.get("x"))
+
+    def create_import_job_task(self, path):
+        with open(path, "rb") as open_file:
+            return ImportTask.objects.create(
+                csv_file=SimpleUploadedFile(os.path.basename(path), open_file.read()), created_by=self.author
+            )
+
+    def test_enqueue_import(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            task = self.create_import_job_task("test_runner/blog/test_files/posts.csv")
+
+            # with no threads, jobs are run as they are submitted
+            with patch.dict("smartmin.jobs.import_runners", {"local": LocalImportRunner(max_workers=0)}):
+                self.assertEqual(4, Post.enqueue_import(task).result())
+
+            task.refresh_from_db()
+            results = json.loads(task.import_results)
+            self.assertEqual(4, results["records"])
+            self.assertEqual(
+                {"queued_on", "started_on", "waited", "elapsed", "rows_per_second"}, set(results["timing"])
+            )
+            self.assertEqual(["new"] * 4, [p.tags for p in Post.objects.filter(title__startswith="My ")])
+
+            # queued imports commit a chunk of rows at a time, so the chunk which fails is rolled back and the import
+            # still has its timing recorded
+            Post.objects.filter(title__startswith="My ").delete()
+            task = self.create_import_job_task("test_runner/blog/test_files/posts.csv")
+
+            def create_instance(field_dict):
+                if field_dict["title"] == "My 2nd post":
+                    raise ValueError("Database went away")
+                return Post.objects.create(**field_dict)
+
+            with patch.object(Post, "create_instance", side_effect=create_instance):
+                with self.assertRaisesRegex(Exception, "Line 3: Database went away"):
+                    ImportJob(Post, task).run()
+
+            task.refresh_from_db()
+            results = json.loads(task.import_results)
+            self.assertIn("Database went away", results["error"])
+            self.assertIn("timing", results)
+            self.assertFalse(Post.objects.filter(title__startswith="My ").exists())
+
+            # chunks committed before a failure stay committed, and running the import again resumes after them
+            task = self.create_import_job_task("test_runner/blog/test_files/posts.csv")
+
+            def create_instance(field_dict):
+                if field_dict["title"] == "My 4th post":
+                    raise ValueError("Database went away")
+                return Post.objects.create(**field_dict)
+
+            with patch.object(Post, "import_chunk_size", 2):
+                with patch.object(Post, "create_instance", side_effect=create_instance):
+                    with self.assertRaisesRegex(Exception, "Line 5: Database went away"):
+                        ImportJob(Post, task).run()
+
+                task.refresh_from_db()
+                results = json.loads(task.import_results)
+                self.assertEqual(2, results["records"])
+                self.assertEqual(3, results["checkpoint"]["line"])
+                self.assertEqual(2, Post.objects.filter(title__startswith="My ").count())
+
+                # and finalizes the records of both runs
+                self.assertEqual(4, len(ImportJob(Post, task).run()))
+                self.assertEqual(["new"] * 4, [p.tags for p in Post.objects.filter(title__startswith="My ")])
+
+            Post.objects.filter(title__startswith="My ").delete()
+            task = self.create_import_job_task("test_runner/blog/test_files/posts.csv")
+
+            # jobs can also be run as Celery tasks, here in eager mode so no broker is needed
+            celery_app.conf.task_always_eager = True
+            self.addCleanup(setattr, celery_app.conf, "task_always_eager", False)
+
+            with override_settings(SMARTMIN_IMPORT_RUNNER="celery"), patch.object(Post, "import_concurrency", 2):
+                self.assertEqual(4, Post.enqueue_import(task).get())
+
+                # workers share slots for running the imports of a model through our cache
+                slot1 = acquire_import_slot(Post)
+                slot2 = acquire_import_slot(Post)
+                self.assertNotEqual(slot1, slot2)
+                self.assertIsNone(acquire_import_slot(Post))
+
+                release_import_slot(slot1)
+                self.assertEqual(slot1, acquire_import_slot(Post))
+                release_import_slot(slot1)
+                release_import_slot(slot2)
+
+            # models without a limit don't need a slot
+            self.assertEqual("", acquire_import_slot(Post))
+
+    def test_local_import_runner(self):
+        lock = threading.Lock()
+        running = defaultdict(int)
+        most_running = defaultdict(int)
+
+        def create_job(label, concurrency):
+            def execute():
+                with lock:
+                    running[label] += 1
+                    most_running[label] = max(most_running[label], running[label])
+                time.sleep(0.05)
+                with lock:
+                    running[label] -= 1
+                return 1
+
+            return SimpleNamespace(queue=label, concurrency=concurrency, execute=execute)
+
+        runner = LocalImportRunner(max_workers=4)
+        futures = [runner.submit(create_job("blog.Post", 1)) for i in range(3)]
+        futures += [runner.submit(create_job("blog.Category", None)) for i in range(3)]
+
+        self.assertEqual([1] * 6, [future.result(timeout=5) for future in futures])
+
+        # only one post import ran at a time, while other imports weren't held up waiting for them
+        self.assertEqual(1, most_running["blog.Post"])
+        self.assertEqual(3, most_running["blog.Category"])
+
+    def test_import_csv_streaming(self):
+        with patch.object(Post, "import_streaming", True), patch.object(Post, "import_chunk_size", 3):
+            task = self.create_import_task("test_runner/blog/test_files/posts.csv")
+            records = Post.import_csv(task)
+
+        self.assertIsInstance(records, ImportedRecords)
+        self.assertEqual(4, len(records))
+        self.assertEqual(
+            [[records.pks[0], records.pks[1], records.pks[2]], [records.pks[3]]], list(records.chunked_pks())
+        )
+        self.assertEqual(["My first post", "My 2nd post", "My 3rd post", "My 4th post"], [p.title for p in records])
+        self.assertEqual({"records": 4, "errors": 0, "error_messages": []}, json.loads(task.import_results))
+
+        Post.finalize_import(task, records)
+        self.assertEqual(4, Post.objects.filter(tags="new").count())
+
 
 class UserTest(TestCase):
     def setUp(self):
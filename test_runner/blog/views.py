@@ -2,7 +2,15 @@ from django import forms
 from django.contrib import messages
 from django.contrib.auth.models import User
 
-from smartmin.views import SmartCreateView, SmartCRUDL, SmartCsvView, SmartListView, SmartReadView, SmartUpdateView
+from smartmin.views import (
+    SmartCreateView,
+    SmartCRUDL,
+    SmartCsvView,
+    SmartListView,
+    SmartReadView,
+    SmartUpdateView,
+    SmartXlsView,
+)
 
 from .models import Category, Post
 
@@ -59,6 +67,7 @@ class PostCRUDL(SmartCRUDL):
         "no_refresh",
         "list_no_pagination",
         "csv",
+        "xls",
     )
 
     class Read(SmartReadView):
@@ -90,6 +99,10 @@ class PostCRUDL(SmartCRUDL):
         fields = ("title", "tags")
         default_order = "title"
 
+    class Xls(SmartXlsView):
+        fields = ("title", "tags")
+        default_order = "title"
+
     class Update(SmartUpdateView):
         success_message = "Your blog post has been updated."
 